@@ -1,102 +1,504 @@
+import argparse
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from itertools import combinations
-from pymatgen.core import Structure, Element
+from pymatgen.core import Structure, Element, DummySpecies
 from pymatgen.core.sites import PeriodicSite
 from pymatgen.io.cif import CifWriter
+from pymatgen.optimization.neighbors import find_points_in_spheres
+from pymatgen.symmetry.analyzer import SpacegroupAnalyzer
 import numpy as np
 
-structure = Structure.from_file("Cu_missing.vasp")
-cutoff = float(input("Type the cutoff Radius:")) # Define the cutoff distance
+# Anions recognised by the script (as reduced formulae of the elemental species)
+anion_list = ["F2", "Cl2", "Br", "I2", "O2", "S"]
 
+# Angle windows (degrees) for accepting a polyhedron, measured between the
+# centre-to-vertex vectors
+tet_window = (106, 113)
+oct_windows = ((86.5, 93.5), (177, 183))
 
-# Find the species in the structure
-species = [site.species.reduced_formula for site in structure]
+# Relative tolerance on edge lengths used to prune candidates in batched mode
+edge_tolerance = 0.2
+
+# Centres closer than this (Angstrom, through periodic images) are merged into one site
+merge_tolerance = 0.5
 
-# Determine the target anion from the species
-anion_list = ["F2", "Cl2", "Br", "I2", "O2", "S"]
-anion = None
-for sp in set(species):
-    if sp in anion_list:
-        anion = sp
-        break
 
-if anion is None:
+def find_anion(structure):
+    """
+    Determine the target anion (reduced formula) from the species in the structure.
+    """
+    species = [site.species.reduced_formula for site in structure]
+    for sp in set(species):
+        if sp in anion_list:
+            return sp
     raise ValueError("No anion found in the structure")
 
-anion_sites = []
 
-# Iterate over each site in the structure
-for site in structure:
-    if site.species.reduced_formula == anion:
-        anion_sites.append(site)
+def anion_neighbor_lists(structure, anion_indices, cutoff, tol=1e-8):
+    """
+    Periodic anion-anion neighbour lists from a linked-cell search.
 
-#print(anion_sites)
+    The anions are wrapped into the cell (fractional coordinates in [0, 1)) and
+    binned with pymatgen's cell-list neighbour finder, so the cost is roughly
+    O(N) and neighbours across the cell boundary are found through their images.
 
+    Returns the wrapped cartesian anion coordinates and, for every anion, a tuple
+    (neighbour positions into anion_indices, image vectors, cartesian coords of
+    the neighbour images).
+    """
+    lattice = np.ascontiguousarray(structure.lattice.matrix, dtype=float)
+    frac_coords = np.mod(structure.frac_coords[anion_indices], 1.0)
+    cart_coords = np.ascontiguousarray(frac_coords @ lattice, dtype=float)
 
+    centers, points, images, distances = find_points_in_spheres(
+        cart_coords,
+        cart_coords,
+        r=float(cutoff),
+        pbc=np.ascontiguousarray(structure.pbc, dtype=np.int64),
+        lattice=lattice,
+        tol=tol,
+    )
+    # Drop each anion's pairing with itself (but keep its own periodic images)
+    keep = ~((centers == points) & (distances <= tol)) & (distances < cutoff)
+    centers, points, images = centers[keep], points[keep], images[keep]
 
-tetrahedra_centers = []
-octahedra_centers = []
+    # Sort by centre so each anion's neighbours are a contiguous block
+    order = np.lexsort((points, centers))
+    centers, points, images = centers[order], points[order], images[order]
+    bounds = np.searchsorted(centers, np.arange(len(anion_indices) + 1))
 
-# Iterate over each anion site
-for site in anion_sites:
-    anions_in_polyhedra = []
-    for candidate_site in anion_sites:
-        if candidate_site == site:
-            continue
-        distance = np.linalg.norm(site.coords - candidate_site.coords)
-        if distance < cutoff:
-            anions_in_polyhedra.append(candidate_site)
-    for n_anions in range(3, 6):
-        for combination in combinations(anions_in_polyhedra, n_anions):
-            if n_anions == 3:
-                center = (site.coords + np.sum([a.coords for a in combination], axis=0)) / (n_anions + 1)
-                tetrahedra = [site.coords, *[a.coords for a in combination]]
-                angles = []
-                for i in range(4):
-                    for j in range(i + 1, 4):
-                        for k in range(j + 1, 4):
-                            i_vec = tetrahedra[i] - center
-                            j_vec = tetrahedra[j] - center
-                            k_vec = tetrahedra[k] - center
+    neighbor_lists = []
+    for i in range(len(anion_indices)):
+        block = slice(bounds[i], bounds[i + 1])
+        neighbor_images = images[block].astype(int)
+        neighbor_coords = cart_coords[points[block]] + neighbor_images @ lattice
+        neighbor_lists.append((points[block], neighbor_images, neighbor_coords))
+
+    return cart_coords, neighbor_lists
+
+
+def find_polyhedra_centers(anion_coords, neighbor_lists, tet_window=tet_window, oct_windows=oct_windows):
+    """
+    Search the anion neighbour lists for tetrahedral and octahedral holes.
+
+    Returns the cartesian centres of the tetrahedra and octahedra found.
+    """
+    tetrahedra_centers = []
+    octahedra_centers = []
+
+    # Iterate over each anion site
+    for site_coords, (_, _, anions_in_polyhedra) in zip(anion_coords, neighbor_lists):
+        for n_anions in range(3, 6):
+            for combination in combinations(anions_in_polyhedra, n_anions):
+                if n_anions == 3:
+                    center = (site_coords + np.sum(combination, axis=0)) / (n_anions + 1)
+                    tetrahedra = [site_coords, *combination]
+                    angles = []
+                    for i in range(4):
+                        for j in range(i + 1, 4):
+                            for k in range(j + 1, 4):
+                                i_vec = tetrahedra[i] - center
+                                j_vec = tetrahedra[j] - center
+                                k_vec = tetrahedra[k] - center
+                                angles.append(np.arccos(np.dot(i_vec, j_vec) / (np.linalg.norm(i_vec) * np.linalg.norm(j_vec))))
+                                angles.append(np.arccos(np.dot(j_vec, k_vec) / (np.linalg.norm(j_vec) * np.linalg.norm(k_vec))))
+                                angles.append(np.arccos(np.dot(k_vec, i_vec) / (np.linalg.norm(k_vec) * np.linalg.norm(i_vec))))
+                    #print("Tetrahedral angles:", np.degrees(angles))
+                    if all(tet_window[0] < a < tet_window[1] for a in np.degrees(angles)):
+                        tetrahedra_centers.append(center)
+                elif n_anions == 5:
+                    center = (site_coords + np.sum(combination, axis=0)) / (n_anions + 1)
+                    octahedra = [site_coords, *combination]
+                    angles = []
+                    for i in range(4):
+                        for j in range(i + 1, 4):
+                            i_vec = octahedra[i] - center
+                            j_vec = octahedra[j] - center
                             angles.append(np.arccos(np.dot(i_vec, j_vec) / (np.linalg.norm(i_vec) * np.linalg.norm(j_vec))))
-                            angles.append(np.arccos(np.dot(j_vec, k_vec) / (np.linalg.norm(j_vec) * np.linalg.norm(k_vec))))
-                            angles.append(np.arccos(np.dot(k_vec, i_vec) / (np.linalg.norm(k_vec) * np.linalg.norm(i_vec))))
-                #print("Tetrahedral angles:", np.degrees(angles))
-                if all(106 < a < 113 for a in np.degrees(angles)):
-                    tetrahedra_centers.append(center)
-            elif n_anions == 5:
-                center = (site.coords + np.sum([a.coords for a in combination], axis=0)) / (n_anions + 1)
-                octahedra = [site.coords, *[a.coords for a in combination]]
-                angles = []
-                for i in range(4):
-                    for j in range(i + 1, 4):
-                        i_vec = octahedra[i] - center
-                        j_vec = octahedra[j] - center
-                        angles.append(np.arccos(np.dot(i_vec, j_vec) / (np.linalg.norm(i_vec) * np.linalg.norm(j_vec))))
-                #print("Octahedral angles:", np.degrees(angles))
-                if all((86.5 < a < 93.5) or (177 < a < 183) for a in np.degrees(angles)):
-                    octahedra_centers.append(center)
-
-#print("Tetrahedra centers:", tetrahedra_centers)
-#print("Octahedra centers:", octahedra_centers)
-
-tet_atom_symbol = input("Enter the symbol of the atom you want to add to the tetrahedral sites: ")
-tet_element = Element(tet_atom_symbol)
-tet_structure = Structure(lattice=structure.lattice, species=[tet_element] * len(tetrahedra_centers),
-                        coords=tetrahedra_centers, coords_are_cartesian=True)
-
-#tet_structure.to(filename="tet_structure.vasp", fmt="poscar")
-
-oct_atom_symbol = input("Enter the symbol of the atom you want to add to the octahedral sites: ")
-oct_element = Element(oct_atom_symbol)
-oct_structure = Structure(lattice=structure.lattice, species=[oct_element] * len(octahedra_centers),
-                        coords=octahedra_centers, coords_are_cartesian=True)
-
-# Concatenate the coordinates of the original structure and the two new structures
-new_sites = structure.sites + tet_structure.sites + oct_structure.sites
-new_structure = Structure.from_sites(new_sites)
-
-new_structure.to(filename="structure_with_added_atoms.vasp", fmt="poscar")
-
-cif_writer = CifWriter(new_structure, symprec=0.1, angle_tolerance=10)
-cif_writer.write_file("new_structure.cif")
+                    #print("Octahedral angles:", np.degrees(angles))
+                    if all(any(low < a < high for low, high in oct_windows) for a in np.degrees(angles)):
+                        octahedra_centers.append(center)
+
+    return tetrahedra_centers, octahedra_centers
+
+
+def polyhedra_angles(vertices):
+    """
+    Angles (degrees) between every pair of centre-to-vertex vectors for a batch
+    of polyhedra. vertices has shape (n_polyhedra, n_vertices, 3); the centre of
+    each polyhedron is the mean of its vertices.
+
+    Returns the centres (n_polyhedra, 3) and angles (n_polyhedra, n_pairs).
+    """
+    centers = vertices.mean(axis=1)
+    vectors = vertices - centers[:, None, :]
+    vectors /= np.linalg.norm(vectors, axis=-1, keepdims=True)
+    i, j = np.triu_indices(vertices.shape[1], k=1)
+    cosines = np.einsum("kpx,kpx->kp", vectors[:, i], vectors[:, j])
+    return centers, np.degrees(np.arccos(np.clip(cosines, -1.0, 1.0)))
+
+
+def _within(values, reference, tolerance):
+    return np.abs(values - reference) <= tolerance * reference
+
+
+def tetrahedra_candidates(site_coords, neighbor_coords, edge_tolerance=edge_tolerance):
+    """
+    Index array (n, 3) of neighbour triplets that could close a regular
+    tetrahedron with the site. A pair of neighbours is only kept if both of its
+    edges to the site and the edge between them agree to within edge_tolerance.
+    """
+    site_edges = np.linalg.norm(neighbor_coords - site_coords, axis=1)
+    pair_edges = np.linalg.norm(neighbor_coords[:, None, :] - neighbor_coords[None, :, :], axis=-1)
+    mean_edge = (site_edges[:, None] + site_edges[None, :] + pair_edges) / 3
+    compatible = (_within(site_edges[:, None], mean_edge, edge_tolerance)
+                  & _within(site_edges[None, :], mean_edge, edge_tolerance)
+                  & _within(pair_edges, mean_edge, edge_tolerance))
+    compatible = np.triu(compatible, k=1)
+
+    # Triangles of mutually compatible pairs, i < j < k
+    triangles = compatible[:, :, None] & compatible[:, None, :] & compatible[None, :, :]
+    return np.argwhere(triangles)
+
+
+def octahedra_candidates(site_coords, neighbor_coords, edge_tolerance=edge_tolerance):
+    """
+    Index array (n, 5) of neighbour sets that could close a regular octahedron
+    with the site. Each neighbour is tried as the vertex trans to the site; only
+    neighbours equidistant from the site and the trans vertex, at the radius set
+    by the trans vertex, are kept as equatorial vertices before the 4-combinations
+    are expanded.
+    """
+    candidates = []
+    for trans in range(len(neighbor_coords)):
+        center = (site_coords + neighbor_coords[trans]) / 2
+        radius = np.linalg.norm(neighbor_coords[trans] - site_coords) / 2
+        to_center = np.linalg.norm(neighbor_coords - center, axis=1)
+        to_site = np.linalg.norm(neighbor_coords - site_coords, axis=1)
+        to_trans = np.linalg.norm(neighbor_coords - neighbor_coords[trans], axis=1)
+        equatorial = np.flatnonzero(_within(to_center, radius, edge_tolerance)
+                                    & _within(to_site, radius * np.sqrt(2), edge_tolerance)
+                                    & _within(to_trans, radius * np.sqrt(2), edge_tolerance))
+        if len(equatorial) < 4:
+            continue
+        square = np.array(list(combinations(equatorial, 4)))
+        candidates.append(np.column_stack([np.full(len(square), trans), square]))
+    if not candidates:
+        return np.empty((0, 5), dtype=int)
+    return np.concatenate(candidates)
+
+
+def find_polyhedra_centers_batched(anion_coords, neighbor_lists, tet_window=tet_window,
+                                   oct_windows=oct_windows, edge_tolerance=edge_tolerance):
+    """
+    Batched version of find_polyhedra_centers.
+
+    Candidate vertex sets are pruned on edge lengths and held as NumPy index
+    arrays; the centres and all pairwise angles are then evaluated in one
+    broadcasted operation per polyhedron type. Unlike the loop version, every
+    vertex pair of an octahedron is checked against oct_windows.
+    """
+    tetrahedra = []
+    octahedra = []
+    for site_coords, (_, _, neighbor_coords) in zip(anion_coords, neighbor_lists):
+        tet_index = tetrahedra_candidates(site_coords, neighbor_coords, edge_tolerance)
+        oct_index = octahedra_candidates(site_coords, neighbor_coords, edge_tolerance)
+        site_block = np.broadcast_to(site_coords, (1, 1, 3))
+        tetrahedra.append(np.concatenate([np.repeat(site_block, len(tet_index), axis=0),
+                                          neighbor_coords[tet_index]], axis=1))
+        octahedra.append(np.concatenate([np.repeat(site_block, len(oct_index), axis=0),
+                                         neighbor_coords[oct_index]], axis=1))
+
+    tetrahedra = np.concatenate(tetrahedra) if tetrahedra else np.empty((0, 4, 3))
+    octahedra = np.concatenate(octahedra) if octahedra else np.empty((0, 6, 3))
+
+    tet_centers, tet_angles = polyhedra_angles(tetrahedra)
+    tet_ok = np.all((tet_window[0] < tet_angles) & (tet_angles < tet_window[1]), axis=1)
+
+    oct_centers, oct_angles = polyhedra_angles(octahedra)
+    oct_ok = np.zeros(oct_angles.shape, dtype=bool)
+    for low, high in oct_windows:
+        oct_ok |= (low < oct_angles) & (oct_angles < high)
+    oct_ok = np.all(oct_ok, axis=1)
+
+    return list(tet_centers[tet_ok]), list(oct_centers[oct_ok])
+
+
+# Read-only search data shared with the worker processes (set by _init_worker)
+_shared = {}
+
+
+def _init_worker(anion_coords, neighbor_lists, settings):
+    _shared["anion_coords"] = anion_coords
+    _shared["neighbor_lists"] = neighbor_lists
+    _shared["settings"] = settings
+
+
+def _search_chunk(bounds):
+    start, stop = bounds
+    return find_polyhedra_centers_batched(_shared["anion_coords"][start:stop],
+                                          _shared["neighbor_lists"][start:stop],
+                                          **_shared["settings"])
+
+
+def find_polyhedra_centers_parallel(anion_coords, neighbor_lists, workers=None, chunk_size=None,
+                                    tet_window=tet_window, oct_windows=oct_windows,
+                                    edge_tolerance=edge_tolerance):
+    """
+    Run find_polyhedra_centers_batched over chunks of the anions in a process pool.
+
+    The coordinates and neighbour lists are handed to each worker once, when
+    the pool starts; tasks only carry the (start, stop) bounds of their chunk.
+    The chunk results are concatenated in anion order, so the output is
+    identical to a serial run.
+    """
+    settings = {"tet_window": tet_window, "oct_windows": oct_windows, "edge_tolerance": edge_tolerance}
+    if workers == 1 or len(anion_coords) == 0:
+        return find_polyhedra_centers_batched(anion_coords, neighbor_lists, **settings)
+
+    workers = workers or os.cpu_count()
+    if chunk_size is None:
+        chunk_size = max(1, -(-len(anion_coords) // (4 * workers)))
+    chunks = [(start, min(start + chunk_size, len(anion_coords)))
+              for start in range(0, len(anion_coords), chunk_size)]
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(anion_coords, neighbor_lists, settings)) as pool:
+        tetrahedra_centers = []
+        octahedra_centers = []
+        for tet_chunk, oct_chunk in pool.map(_search_chunk, chunks):
+            tetrahedra_centers.extend(tet_chunk)
+            octahedra_centers.extend(oct_chunk)
+
+    return tetrahedra_centers, octahedra_centers
+
+
+def merge_periodic_sites(cart_centers, lattice, tolerance=merge_tolerance):
+    """
+    Merge centres that coincide within tolerance (Angstrom) under periodic boundaries.
+
+    The centres are wrapped into the cell and hashed on their fractional
+    coordinates into grid cells at least tolerance wide, so each insertion only
+    compares against the 27 surrounding cells (wrapping round the cell edges).
+
+    Returns the fractional coordinates of the unique sites (first hit kept) and
+    the number of times each one was found.
+    """
+    matrix = np.asarray(lattice.matrix, dtype=float)
+    frac_centers = np.mod(np.reshape(cart_centers, (-1, 3)) @ np.linalg.inv(matrix), 1.0)
+
+    # Number of grid cells along each axis; plane spacing / n_bins >= tolerance
+    plane_spacing = 1 / np.linalg.norm(np.linalg.inv(matrix).T, axis=1)
+    n_bins = np.maximum(1, np.floor(plane_spacing / tolerance)).astype(int)
+    shifts = {(i, j, k) for i in (-1, 0, 1) for j in (-1, 0, 1) for k in (-1, 0, 1)}
+
+    grid = {}
+    unique_coords = []
+    multiplicities = []
+    for frac in frac_centers:
+        key = tuple(np.minimum(np.floor(frac * n_bins).astype(int), n_bins - 1))
+        neighbor_keys = {tuple(np.add(key, shift) % n_bins) for shift in shifts}
+
+        match = None
+        for neighbor_key in neighbor_keys:
+            for site in grid.get(neighbor_key, ()):
+                diff = frac - unique_coords[site]
+                diff -= np.round(diff)
+                if np.linalg.norm(diff @ matrix) < tolerance:
+                    match = site
+                    break
+            if match is not None:
+                break
+
+        if match is None:
+            grid.setdefault(key, []).append(len(unique_coords))
+            unique_coords.append(frac)
+            multiplicities.append(1)
+        else:
+            multiplicities[match] += 1
+
+    return np.reshape(unique_coords, (-1, 3)), multiplicities
+
+
+def unique_anion_positions(symmetrized, anion_indices):
+    """
+    Positions (into anion_indices) of one anion from each set of symmetrically
+    equivalent anions, taken from SpacegroupAnalyzer's symmetrized structure.
+    """
+    position = {index: i for i, index in enumerate(anion_indices)}
+    return [position[group[0]] for group in symmetrized.equivalent_indices if group[0] in position]
+
+
+def expand_by_symmetry(frac_sites, operations, lattice, tolerance=merge_tolerance):
+    """
+    Expand unique sites into their full orbits with the space-group operations.
+
+    Sites that turn out to lie in an orbit already generated are dropped.
+    Returns a list with the fractional coordinates of each orbit.
+    """
+    orbits = []
+    seen = np.empty((0, 3))
+    matrix = np.asarray(lattice.matrix, dtype=float)
+    for frac in frac_sites:
+        if len(seen):
+            diff = seen - frac
+            diff -= np.round(diff)
+            if np.min(np.linalg.norm(diff @ matrix, axis=1)) < tolerance:
+                continue
+        images = np.array([op.operate(frac) for op in operations])
+        orbit, _ = merge_periodic_sites(images @ matrix, lattice, tolerance)
+        orbits.append(orbit)
+        seen = np.concatenate([seen, orbit])
+    return orbits
+
+
+def wyckoff_labels(structure, tet_sites, oct_sites, symprec=0.1):
+    """
+    Wyckoff labels (e.g. "6i") of every tetrahedral and octahedral site, found by
+    analysing the host with the sites filled by placeholder species.
+    """
+    filled = structure.copy()
+    for frac in tet_sites:
+        filled.append(DummySpecies("Xt"), frac)
+    for frac in oct_sites:
+        filled.append(DummySpecies("Xo"), frac)
+
+    symmetrized = SpacegroupAnalyzer(filled, symprec=symprec).get_symmetrized_structure()
+    labels = [None] * len(filled)
+    for group, symbol in zip(symmetrized.equivalent_indices, symmetrized.wyckoff_symbols):
+        for index in group:
+            labels[index] = symbol
+
+    n_host = len(structure)
+    return labels[n_host:n_host + len(tet_sites)], labels[n_host + len(tet_sites):]
+
+
+def symmetry_reduced_search(structure, anion_indices, cutoff, symprec=0.1, tolerance=merge_tolerance,
+                            workers=1, **search_settings):
+    """
+    Run the polyhedron search from the symmetrically distinct anions only, then
+    expand the unique centres with the space-group operations.
+
+    Returns the fractional coordinates of the tetrahedral and octahedral sites
+    and their Wyckoff labels.
+    """
+    anion_coords, neighbor_lists = anion_neighbor_lists(structure, anion_indices, cutoff)
+    analyzer = SpacegroupAnalyzer(structure, symprec=symprec)
+    unique = unique_anion_positions(analyzer.get_symmetrized_structure(), anion_indices)
+    tetrahedra_centers, octahedra_centers = find_polyhedra_centers_parallel(
+        anion_coords[unique], [neighbor_lists[i] for i in unique], workers=workers, **search_settings)
+
+    operations = analyzer.get_symmetry_operations()
+    tet_unique, _ = merge_periodic_sites(tetrahedra_centers, structure.lattice, tolerance)
+    oct_unique, _ = merge_periodic_sites(octahedra_centers, structure.lattice, tolerance)
+    tet_orbits = expand_by_symmetry(tet_unique, operations, structure.lattice, tolerance)
+    oct_orbits = expand_by_symmetry(oct_unique, operations, structure.lattice, tolerance)
+
+    tetrahedra_sites = np.concatenate(tet_orbits) if tet_orbits else np.empty((0, 3))
+    octahedra_sites = np.concatenate(oct_orbits) if oct_orbits else np.empty((0, 3))
+    tet_labels, oct_labels = wyckoff_labels(structure, tetrahedra_sites, octahedra_sites, symprec)
+    return tetrahedra_sites, octahedra_sites, tet_labels, oct_labels
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Find the tetrahedral and octahedral holes of the anion "
+                                                 "framework and fill them with the chosen species. "
+                                                 "Any setting not given on the command line is prompted for.")
+    parser.add_argument("structure", nargs="?", default="Cu_missing.vasp", help="Input structure file")
+    parser.add_argument("--cutoff", type=float, help="Anion-anion cutoff radius (Angstrom)")
+    parser.add_argument("--tet-species", help="Element to place on the tetrahedral sites")
+    parser.add_argument("--oct-species", help="Element to place on the octahedral sites")
+    parser.add_argument("--tet-window", type=float, nargs=2, default=tet_window, metavar=("LOW", "HIGH"),
+                        help="Accepted tetrahedral angle range (degrees)")
+    parser.add_argument("--oct-window", type=float, nargs=2, action="append", metavar=("LOW", "HIGH"),
+                        help="Accepted octahedral angle range (degrees), may be repeated")
+    parser.add_argument("--edge-tolerance", type=float, default=edge_tolerance,
+                        help="Relative edge-length tolerance for candidate pruning")
+    parser.add_argument("--merge-tolerance", type=float, default=merge_tolerance,
+                        help="Distance (Angstrom) below which site centres are merged")
+    parser.add_argument("--loop", action="store_true", help="Use the original loop evaluation instead of the batched one")
+    parser.add_argument("--symmetry", action="store_true",
+                        help="Search only from symmetrically distinct anions and expand with the space group")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes (0 for all cores)")
+    parser.add_argument("--output", default="structure_with_added_atoms.vasp", help="Output POSCAR")
+    parser.add_argument("--cif", default="new_structure.cif", help="Output CIF")
+    args = parser.parse_args(argv)
+    if args.loop and args.symmetry:
+        parser.error("--loop is not available with --symmetry (the symmetry search uses the batched evaluation)")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    structure = Structure.from_file(args.structure)
+    cutoff = args.cutoff if args.cutoff is not None else float(input("Type the cutoff Radius:")) # Define the cutoff distance
+    workers = args.workers or None
+    settings = {"tet_window": tuple(args.tet_window),
+                "oct_windows": tuple(map(tuple, args.oct_window)) if args.oct_window else oct_windows,
+                "edge_tolerance": args.edge_tolerance}
+
+    # Determine the target anion from the species
+    anion = find_anion(structure)
+    anion_indices = [i for i, site in enumerate(structure) if site.species.reduced_formula == anion]
+
+    if args.symmetry:
+        # Search from the symmetrically distinct anions and expand with the space group
+        tetrahedra_sites, octahedra_sites, tet_labels, oct_labels = symmetry_reduced_search(
+            structure, anion_indices, cutoff, tolerance=args.merge_tolerance, workers=workers, **settings)
+        print(f"Tetrahedral sites: {len(tetrahedra_sites)}, Wyckoff positions {dict(sorted(Counter(tet_labels).items()))}")
+        print(f"Octahedral sites: {len(octahedra_sites)}, Wyckoff positions {dict(sorted(Counter(oct_labels).items()))}")
+    else:
+        # Periodic neighbour lists of every anion, then the polyhedron search on top
+        anion_coords, neighbor_lists = anion_neighbor_lists(structure, anion_indices, cutoff)
+        if args.loop:
+            tetrahedra_centers, octahedra_centers = find_polyhedra_centers(
+                anion_coords, neighbor_lists, settings["tet_window"], settings["oct_windows"])
+        else:
+            tetrahedra_centers, octahedra_centers = find_polyhedra_centers_parallel(
+                anion_coords, neighbor_lists, workers=workers, **settings)
+
+        #print("Tetrahedra centers:", tetrahedra_centers)
+        #print("Octahedra centers:", octahedra_centers)
+
+        # Each hole is found once from every anion on it, merge the repeats
+        tetrahedra_sites, tet_multiplicities = merge_periodic_sites(tetrahedra_centers, structure.lattice,
+                                                                    args.merge_tolerance)
+        octahedra_sites, oct_multiplicities = merge_periodic_sites(octahedra_centers, structure.lattice,
+                                                                   args.merge_tolerance)
+        print(f"Tetrahedral sites: {len(tetrahedra_centers)} hits merged into {len(tetrahedra_sites)} sites, "
+              f"multiplicities {dict(sorted(Counter(tet_multiplicities).items()))}")
+        print(f"Octahedral sites: {len(octahedra_centers)} hits merged into {len(octahedra_sites)} sites, "
+              f"multiplicities {dict(sorted(Counter(oct_multiplicities).items()))}")
+        tet_labels = oct_labels = None
+
+    tet_atom_symbol = args.tet_species or input("Enter the symbol of the atom you want to add to the tetrahedral sites: ")
+    tet_element = Element(tet_atom_symbol)
+    tet_structure = Structure(lattice=structure.lattice, species=[tet_element] * len(tetrahedra_sites),
+                            coords=tetrahedra_sites,
+                            site_properties={"wyckoff": tet_labels} if args.symmetry else None)
+
+    #tet_structure.to(filename="tet_structure.vasp", fmt="poscar")
+
+    oct_atom_symbol = args.oct_species or input("Enter the symbol of the atom you want to add to the octahedral sites: ")
+    oct_element = Element(oct_atom_symbol)
+    oct_structure = Structure(lattice=structure.lattice, species=[oct_element] * len(octahedra_sites),
+                            coords=octahedra_sites,
+                            site_properties={"wyckoff": oct_labels} if args.symmetry else None)
+
+    # Concatenate the coordinates of the original structure and the two new structures
+    # (in symmetry mode the host sites get an empty Wyckoff label, so every site has the property;
+    # from_sites treats None as missing)
+    host = structure.copy(site_properties={"wyckoff": [""] * len(structure)}) if args.symmetry else structure
+    new_sites = host.sites + tet_structure.sites + oct_structure.sites
+    new_structure = Structure.from_sites(new_sites)
+
+    new_structure.to(filename=args.output, fmt="poscar")
+
+    cif_writer = CifWriter(new_structure, symprec=0.1, angle_tolerance=10)
+    cif_writer.write_file(args.cif)
+
 
+if __name__ == "__main__":
+    main()
@@ -10,63 +10,38 @@
 #   number of files and folders i.e. 200 are created in this example
 
 #   Please analyse XDATCAR before use and choose 'split' appropriately.
-    
+
+#   Alternatively use --select N to pick only the N most structurally distinct
+#   frames (radial fingerprints, farthest-point or k-means selection); the
+#   chosen frames and their fingerprint distances are listed in
+#   frame_selection.txt.
+
+#   The INCAR/KPOINTS/POTCAR are built once and reused for every frame, and the
+#   step directories are written from a process pool (--workers). Files are
+#   written under absolute paths and renamed into place, so an interrupted run
+#   can simply be restarted: directories that are already complete are skipped.
+
 
 #   Import required modules
 
+import argparse
 import os
-from pymatgen.core import Structure
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from pymatgen.core import Structure, Lattice
+from pymatgen.io.vasp.inputs import Poscar
 from pymatgen.io.vasp.sets import MPRelaxSet
+from trajectory import open_trajectory
+from frame_selection import select_frames
 
 #------------------------------------------------------------------------
 
-path = os.getcwd()
-
-# read the lines
-f=open("XDATCAR")
-lines=f.readlines()
-f.close()
-
-
-no_atoms = input("Number of atoms in the structure: ")
-split = input("Number of steps between each POSCAR generation: ")
-atoms = int(no_atoms)
-steps = int(split)
-
-file_number=0 # counter for the files
-line_counter=0 # keeps track of the number of lines written in the file so far
-
-for i in range(7,len(lines)):
-    if line_counter==0: # we started writing to a file
-        os.mkdir(path + "/step" + str(file_number)) # make new directory
-        os.chdir(path + "/step" + str(file_number)) # move to new directory
-        f=open("POSCAR","w") # open file
-        for j in range(7):# write the first seven lines
-            f.write(lines[j])
-
-    if line_counter <= atoms:
-        f.write(lines[i])# write one line
-        line_counter+=1 # increment line counter
-    else:
-        line_counter+=1
-    
-    if line_counter == (atoms + 1) * steps:
-        f.close()
-        
-#------------------------------------------------------------------------------------------
-#       Following code creates input files for a VASP relaxation using MP parameters
-        
-        Structure = Structure.from_file("POSCAR")
-        relax = MPRelaxSet(Structure,user_incar_settings={"ISMEAR":0,"EDIFF":1E-5,"ISYM":0,"NCORE":4,"NSW":191})
-        relax.write_input("structure_relax")
-        
-        os.chdir("structure_relax")
+relax_settings = {"ISMEAR":0,"EDIFF":1E-5,"ISYM":0,"NCORE":4,"NSW":191}
 
 #-------------------------------------------------------------------------------
-#   Creates a script for the HPC to run VASP, change bottom line appropriately
+#   Script for the HPC to run VASP, change bottom line appropriately
 
-        with open('vasp_script','w') as f:
-            f.writelines('''
+vasp_script = '''
         #PBS -lselect=1:ncpus=32:mpiprocs=32:mem=60gb
         #PBS -lwalltime=48:00:00
         #PBS -N vasprun
@@ -88,17 +63,149 @@ for i in range(7,len(lines)):
         # 'mpiexec /absolute path to vasp executable'
 
         mpiexec /rds/general/user/kab121/home/VASP/vasp.6.1.2_patched_vtst/bin/vasp_std
-        ''')
-        
-#-------------------------------------------------------------------------------------
-
-        
-        file_number+=1 # start writing to a new file
-        line_counter=0 
-        os.chdir(path)
-
-if f.closed == False: # the file was not closed properly in the for loop
-    f.close()
-    
+        '''
+
+#-------------------------------------------------------------------------------
+
+
+def input_template(structure, potcar_spec=False):
+    """
+    INCAR, KPOINTS and POTCAR text of the MP relaxation set, built once from
+    the first frame and shared by all frames (same species and atom order).
+    """
+    relax = MPRelaxSet(structure, user_incar_settings=relax_settings)
+    if potcar_spec:
+        potcar = ("POTCAR.spec", "\n".join(relax.potcar_symbols))
+    else:
+        potcar = ("POTCAR", str(relax.potcar))
+    return {"INCAR": str(relax.incar), "KPOINTS": str(relax.kpoints), "potcar": potcar,
+            "lattice": structure.lattice.matrix.copy()}
+
+
+def _write_file(filename, text):
+    # Write next to the target and rename, so a file is either complete or absent
+    with open(filename + ".tmp", "w") as f:
+        f.write(text)
+    os.replace(filename + ".tmp", filename)
+
+
+def step_files(directory, template):
+    relax_dir = os.path.join(directory, "structure_relax")
+    return [os.path.join(directory, "POSCAR")] + [os.path.join(relax_dir, name) for name in
+                                                  ("INCAR", "KPOINTS", "POSCAR", template["potcar"][0], "vasp_script")]
+
+
+def is_complete(directory, template):
+    return all(os.path.exists(f) for f in step_files(directory, template))
+
+
+_template = {}
+
+
+def _init_worker(template):
+    _template.update(template)
+
+
+def write_step(task):
+    """
+    Write one step directory: task is (directory, lattice, species, frac_coords, comment).
+    """
+    directory, lattice, species, frac_coords, comment = task
+    template = _template
+    structure = Structure(Lattice(lattice), species, frac_coords)
+    poscar = Poscar(structure, comment=comment).get_str()
+
+    # Variable-cell frames need their own k-point mesh
+    kpoints = template["KPOINTS"]
+    if not np.allclose(lattice, template["lattice"], atol=1e-3):
+        kpoints = str(MPRelaxSet(structure, user_incar_settings=relax_settings).kpoints)
+
+    relax_dir = os.path.join(directory, "structure_relax")
+    os.makedirs(relax_dir, exist_ok=True)
+    potcar_name, potcar_text = template["potcar"]
+    _write_file(os.path.join(directory, "POSCAR"), poscar)
+    _write_file(os.path.join(relax_dir, "INCAR"), template["INCAR"])
+    _write_file(os.path.join(relax_dir, "KPOINTS"), kpoints)
+    _write_file(os.path.join(relax_dir, "POSCAR"), poscar)
+    _write_file(os.path.join(relax_dir, potcar_name), potcar_text)
+    _write_file(os.path.join(relax_dir, "vasp_script"), vasp_script)
+    return directory
+
+
+def write_steps(frames, species, comment, path, template, workers=None, max_pending=64):
+    """
+    Write step0, step1, ... under path for the given frames from a process
+    pool, skipping directories that are already complete. Frames are read
+    lazily and at most max_pending are held in memory at a time.
+    """
+    written = skipped = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(template,)) as pool:
+        pending = []
+        for file_number, frame in enumerate(frames):
+            directory = os.path.join(path, "step" + str(file_number))
+            if is_complete(directory, template):
+                skipped += 1
+                continue
+            task = (directory, np.array(frame.lattice), species, np.array(frame.frac_coords, dtype=float),
+                    f"{comment} configuration {frame.step}")
+            pending.append(pool.submit(write_step, task))
+            if len(pending) >= max_pending:
+                pending.pop(0).result()
+                written += 1
+        for future in pending:
+            future.result()
+            written += 1
+    print(f"Wrote {written} step directories, skipped {skipped} already complete")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Write relaxation inputs for every split-th MD frame.")
+    parser.add_argument("trajectory", nargs="?", default="XDATCAR",
+                        help="XDATCAR, or a binary trajectory directory made by trajectory.py")
+    parser.add_argument("--split", type=int, help="Number of steps between each POSCAR generation")
+    parser.add_argument("--select", type=int, help="Write only this many most distinct frames instead of every split-th")
+    parser.add_argument("--method", choices=["fps", "kmeans"], default="fps",
+                        help="Selection method: farthest-point sampling or k-means")
+    parser.add_argument("--candidate-stride", type=int, default=1, help="Only consider every n-th frame for selection")
+    parser.add_argument("--fingerprint-cutoff", type=float, default=6.0, help="Cutoff (A) of the radial fingerprint")
+    parser.add_argument("--workers", type=int, help="Number of worker processes (default: all cores)")
+    parser.add_argument("--potcar-spec", action="store_true", help="Write POTCAR.spec instead of POTCAR")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    path = os.path.abspath(os.getcwd())
+
+    # The atom count and species are read from the XDATCAR header; frames are
+    # streamed one at a time rather than reading the whole file into memory
+    trajectory = open_trajectory(args.trajectory)
+    header = trajectory.header
+    species = trajectory.species
+    print(f"{len(species)} atoms in the structure ({header.comment})")
+
+    if args.select:
+        selected, distances = select_frames(trajectory, args.select, args.method, args.candidate_stride,
+                                            args.fingerprint_cutoff)
+        order = selected.argsort()
+        frames = trajectory.read_frames(selected[order])
+        with open("frame_selection.txt", "w") as f:
+            f.write("Directory\tFrame\tFingerprint distance\n")
+            for file_number, i in enumerate(order):
+                f.write(f"step{file_number}\t{selected[i]}\t{distances[i]:.4f}\n")
+        print(f"Selected {len(selected)} frames ({args.method}), see frame_selection.txt")
+    else:
+        split = args.split or input("Number of steps between each POSCAR generation: ")
+        steps = int(split)
+        frames = trajectory.iter_frames(stride=steps)
+
+#------------------------------------------------------------------------------------------
+#       Input files for a VASP relaxation using MP parameters, built once from the first frame
+
+    first = next(trajectory.iter_frames(stop=1))
+    template = input_template(Structure(Lattice(first.lattice), species, first.frac_coords), args.potcar_spec)
+
+    write_steps(frames, species, header.comment, path, template, args.workers)
+
 #---------------------------------------------------------------------
-#       Done  
\ No newline at end of file
+#       Done
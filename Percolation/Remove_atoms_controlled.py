@@ -1,82 +1,201 @@
 from pymatgen.io.vasp.inputs import Poscar
+from itertools import islice
+import argparse
+import os
+import numpy as np
 import random
 
 # Set a random seed for reproducibility
 random_seed = 42
-random.seed(random_seed)
 
 # Load the input structure from POSCAR file
 poscar_file = "all_1_layer_Zr.vasp"
-structure = Poscar.from_file(poscar_file).structure
 
 # Define the maximum distance for immediate neighbors and further radius for void check
 max_distance = 3.0  # Radius for immediate neighbor check
 further_radius = 6.0  # Radius to check for avoiding large voids
 
-def remove_species_with_constraints(structure, chosen_species, removal_percentage, max_distance, further_radius):
+
+def build_neighbor_graph(structure, chosen_species, max_distance, further_radius, tol=1e-8):
+    """
+    Periodic neighbour graph of the chosen species, computed once with get_neighbor_list.
+
+    Returns the indices of the chosen species, for each of them the number of
+    other-species neighbours within max_distance and the number of neighbours
+    within further_radius, and the further_radius neighbour lists in CSR form
+    (offsets, neighbours) indexed by position in the candidate list. Neighbours
+    are counted per periodic image, as structure.get_neighbors does.
+    """
+    species = np.array([site.species_string for site in structure])
+    candidates = np.flatnonzero(species == chosen_species)
+    if len(candidates) == 0:
+        # get_neighbor_list cannot take an empty site list; nothing to remove
+        empty = np.array([], dtype=int)
+        return candidates, empty, empty, np.zeros(1, dtype=int), empty
+
+    centers, points, _, distances = structure.get_neighbor_list(
+        further_radius, sites=[structure[i] for i in candidates], numerical_tol=tol)
+
+    near_foreign = (distances <= max_distance + tol) & (species[points] != chosen_species)
+    foreign_counts = np.bincount(centers[near_foreign], minlength=len(candidates))
+    further_counts = np.bincount(centers, minlength=len(candidates))
+
+    order = np.argsort(centers, kind="stable")
+    offsets = np.searchsorted(centers[order], np.arange(len(candidates) + 1))
+    return candidates, foreign_counts, further_counts, offsets, points[order]
+
+
+def removal_sequence(structure, chosen_species, max_distance, further_radius, rng=random, verbose=True):
+    """
+    Generator of the atoms (input numbering) removed one after another from the
+    chosen species, only taking atoms that have a neighbour of another species
+    within max_distance and more than one neighbour within further_radius.
+
+    The neighbour graph is built once; each removal only decrements the
+    further_radius counts of the removed atom's neighbours, and atoms that fall
+    out of the eligible pool are dropped from it. The candidate order is drawn
+    by reshuffling the remaining atoms after every removal, exactly as the
+    original rebuild-and-rescan loop did, so the same seed gives the same
+    sequence. The sequence ends when no remaining atom meets the constraints.
+    The graph and the first shuffle are done on the call, before iteration.
+    """
+    candidates, foreign_counts, further_counts, offsets, neighbors = build_neighbor_graph(
+        structure, chosen_species, max_distance, further_radius)
+    position = {index: i for i, index in enumerate(candidates)}
+    further_counts = further_counts.copy()
+
+    # Pool of atoms that currently satisfy the constraints (only shrinks as atoms are removed)
+    eligible = {int(candidates[i]) for i in np.flatnonzero((foreign_counts > 0) & (further_counts > 1))}
+
+    # Remaining atoms of the chosen species, in structure order
+    remaining = [int(i) for i in candidates]
+    species_indices = remaining[:]
+    rng.shuffle(species_indices)
+
+    def sequence(species_indices):
+        n_removed = 0
+        while species_indices:
+            index = next((i for i in species_indices if i in eligible), None)
+            if index is None:
+                if verbose:
+                    print(f"  --> No remaining {chosen_species} atom meets the constraints.")
+                return
+
+            n_removed += 1
+            eligible.discard(index)
+            remaining.remove(index)
+
+            # The removed atom no longer counts towards its neighbours' void check
+            p = position[index]
+            for neighbor in neighbors[offsets[p]:offsets[p + 1]]:
+                q = position.get(int(neighbor))
+                if q is None:
+                    continue
+                further_counts[q] -= 1
+                if further_counts[q] <= 1:
+                    eligible.discard(int(neighbor))
+
+            if verbose:
+                print(f"  --> Removed {chosen_species} atom at index {index} (input numbering). Total removed: {n_removed}")
+                print(f"      - Other-species neighbors within {max_distance} Å: {foreign_counts[p]}")
+                print(f"      - Neighbors within {further_radius} Å: {further_counts[p]}")
+
+            species_indices = remaining[:]
+            rng.shuffle(species_indices)  # Shuffle again after updating
+            yield index
+
+    return sequence(species_indices)
+
+
+def remove_species_with_constraints(structure, chosen_species, removal_percentage, max_distance, further_radius,
+                                    rng=random, verbose=True):
+    """
+    Remove a percentage of the chosen species under the neighbour constraints
+    (see removal_sequence). All removals are applied in one remove_sites call.
+    """
     # Calculate the number of species to remove
     num_species = structure.composition[chosen_species]
     num_to_remove = int(num_species * (removal_percentage / 100))
 
-    # Get indices of the chosen species
-    species_indices = [i for i, site in enumerate(structure) if site.species_string == chosen_species]
-    random.shuffle(species_indices)
-
-    removed_atoms = 0
-
-    while removed_atoms < num_to_remove and species_indices:
-        for index in species_indices[:]:
-            # Check distances to nearby atoms within max_distance
-            site = structure[index]
-            neighbors_within_max = structure.get_neighbors(site, max_distance)
-            neighbors_within_further = structure.get_neighbors(site, further_radius)
-
-            # Number of nearest neighbors within max_distance
-            num_neighbors_within_max = len(neighbors_within_max)
-            # Number of neighbors within further_radius
-            num_neighbors_within_further = len(neighbors_within_further)
-
-            # Check if there are neighbors within max_distance and that there are more than one neighbor within further_radius
-            if any(neighbor.species_string != chosen_species for neighbor, _, _, _ in neighbors_within_max) and num_neighbors_within_further > 1:
-                structure.remove_sites([index])
-                removed_atoms += 1
-                species_indices.remove(index)  # Remove index from the list after removal
-                # Update species_indices for the new structure
-                species_indices = [i for i, site in enumerate(structure) if site.species_string == chosen_species]
-                random.shuffle(species_indices)  # Shuffle again after updating
-                print(f"  --> Removed {chosen_species} atom at index {index}. Total removed: {removed_atoms}")
-                print(f"      - Neighbors within {max_distance} Å: {num_neighbors_within_max}")
-                print(f"      - Neighbors within {further_radius} Å: {num_neighbors_within_further}")
-                break  # Reevaluate the structure after each removal
-            else:
-                print(f"  --> Did not remove {chosen_species} atom at index {index} (doesn't meet constraints)")
-                print(f"      - Neighbors within {max_distance} Å: {num_neighbors_within_max}")
-                print(f"      - Neighbors within {further_radius} Å: {num_neighbors_within_further}")
-
-        # Exit loop if no more atoms can be removed
-        if removed_atoms == num_to_remove or not species_indices:
-            break
+    sequence = removal_sequence(structure, chosen_species, max_distance, further_radius, rng, verbose)
+    removed_indices = list(islice(sequence, num_to_remove))
+    structure.remove_sites(sorted(removed_indices))
 
-    print(f"\nSuccessfully removed {removed_atoms} {chosen_species} atoms.")
+    print(f"\nSuccessfully removed {len(removed_indices)} {chosen_species} atoms.")
     return structure
 
-# Remove species in a loop until the user decides to stop
-while True:
-    chosen_species = input("Choose a species to remove: ").strip()
-    removal_percentage = float(input(f"Enter the removal percentage for {chosen_species}: "))
-
-    structure = remove_species_with_constraints(structure, chosen_species, removal_percentage, max_distance, further_radius)
-    
-    more_removals = input("Do you want to remove another species? (yes/no): ").strip().lower()
-    if more_removals != 'yes':
-        break
-
-# Save the modified structure to a new POSCAR file
-new_poscar_file = f"final_structure_{structure.composition.reduced_formula}_random.vasp"
-Poscar(structure).write_file(new_poscar_file)
-
-# Print the reduced formula of the final structure
-reduced_formula = structure.composition.reduced_formula
-print("Species removal completed and saved to", new_poscar_file)
-print("Reduced formula of the final structure:", reduced_formula)
-print("Random seed used:", random_seed)
\ No newline at end of file
+
+def sweep_removal(structure, chosen_species, percentages, max_distance, further_radius, output_dir="sweep",
+                  rng=random):
+    """
+    Write nested configurations for a list of removal percentages from one
+    neighbour graph: each level continues the removal sequence of the previous
+    one, so the whole sweep costs one full-depth removal. Level k is the same
+    structure remove_species_with_constraints gives for that percentage and seed.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    num_species = structure.composition[chosen_species]
+    sequence = removal_sequence(structure, chosen_species, max_distance, further_radius, rng, verbose=False)
+
+    removed_indices = []
+    written = []
+    for percentage in sorted(percentages):
+        num_to_remove = int(num_species * (percentage / 100))
+        removed_indices.extend(islice(sequence, num_to_remove - len(removed_indices)))
+        level = structure.copy()
+        level.remove_sites(sorted(removed_indices))
+        filename = os.path.join(output_dir, f"{chosen_species}_{percentage:g}pct.vasp")
+        Poscar(level).write_file(filename)
+        written.append(filename)
+        print(f"{percentage:g}%: removed {len(removed_indices)} {chosen_species}, "
+              f"{level.composition.reduced_formula} -> {filename}")
+        if len(removed_indices) < num_to_remove:
+            print(f"Stopping the sweep: no further {chosen_species} atom meets the constraints.")
+            break
+    return written
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Remove atoms under neighbour constraints. "
+                                                 "Without --sweep the removals are prompted for.")
+    parser.add_argument("--input", default=poscar_file, help="Input POSCAR")
+    parser.add_argument("--species", help="Species to remove in the sweep")
+    parser.add_argument("--sweep", type=float, nargs=3, metavar=("START", "STOP", "STEP"),
+                        help="Removal percentages for the sweep, STOP included")
+    parser.add_argument("--output-dir", default="sweep", help="Directory for the sweep POSCARs")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.sweep and not args.species:
+        raise ValueError("--sweep needs the --species to remove")
+    random.seed(random_seed)
+    structure = Poscar.from_file(args.input).structure
+
+    if args.sweep:
+        start, stop, step = args.sweep
+        percentages = np.arange(start, stop + step / 2, step)
+        sweep_removal(structure, args.species, percentages, max_distance, further_radius, args.output_dir)
+        print("Random seed used:", random_seed)
+    else:
+        # Remove species in a loop until the user decides to stop
+        while True:
+            chosen_species = input("Choose a species to remove: ").strip()
+            removal_percentage = float(input(f"Enter the removal percentage for {chosen_species}: "))
+
+            structure = remove_species_with_constraints(structure, chosen_species, removal_percentage, max_distance, further_radius)
+
+            more_removals = input("Do you want to remove another species? (yes/no): ").strip().lower()
+            if more_removals != 'yes':
+                break
+
+        # Save the modified structure to a new POSCAR file
+        new_poscar_file = f"final_structure_{structure.composition.reduced_formula}_random.vasp"
+        Poscar(structure).write_file(new_poscar_file)
+
+        # Print the reduced formula of the final structure
+        reduced_formula = structure.composition.reduced_formula
+        print("Species removal completed and saved to", new_poscar_file)
+        print("Reduced formula of the final structure:", reduced_formula)
+        print("Random seed used:", random_seed)
@@ -1,78 +1,131 @@
 from pymatgen.io.vasp.inputs import Poscar
 from pymatgen.core.structure import Structure
+import numpy as np
 import random
 
 # Set a random seed for reproducibility
 random_seed = 42
-random.seed(random_seed)
 
 # Load the input structure from POSCAR file
 poscar_file = "Li2ZrCl6_5x5x10_all.vasp"
-structure = Poscar.from_file(poscar_file).structure
 
 # Define the maximum distance for immediate neighbors and further radius for void check
 max_distance = 3.0  # Radius for immediate neighbor check
 further_radius = 6.0  # Radius to check for avoiding large voids
 
-def remove_species_simultaneously(structure):
-    # Prompt user to choose species and specify the removal percentage for each
-    chosen_species = input("Choose species to remove (comma-separated): ").split(',')
-    removal_percentages = list(map(float, input("Enter removal percentages for each species (comma-separated): ").split(',')))
 
+def neighbor_table(structure, indices, radius, tol=1e-8):
+    """
+    Periodic neighbour table of the given sites, from one get_neighbor_list call.
+
+    Returns CSR offsets into the neighbour indices and distances, indexed by
+    position in indices; neighbour indices refer to the full structure.
+    """
+    if len(indices) == 0:
+        # get_neighbor_list cannot take an empty site list
+        return np.zeros(1, dtype=int), np.array([], dtype=int), np.array([])
+    centers, points, _, distances = structure.get_neighbor_list(
+        radius, sites=[structure[i] for i in indices], numerical_tol=tol)
+    order = np.argsort(centers, kind="stable")
+    offsets = np.searchsorted(centers[order], np.arange(len(indices) + 1))
+    return offsets, points[order], distances[order]
+
+
+def remove_species_simultaneously(structure, chosen_species, removal_percentages, log_neighbors=False, rng=random):
+    """
+    Remove a percentage of each chosen species, rejecting atoms whose removal
+    would leave no neighbours within further_radius.
+
+    Removals are recorded on an index mask and the constraint is evaluated
+    against a neighbour table computed once for all chosen species, with the
+    neighbour counts updated as atoms are removed. Site indices therefore
+    always refer to the input structure, and all removals are applied in one
+    remove_sites call at the end. Set log_neighbors to print every immediate
+    neighbour of each candidate; otherwise only summary statistics are printed.
+    """
     if len(chosen_species) != len(removal_percentages):
         raise ValueError("The number of chosen species and removal percentages must match.")
 
-    indices_to_remove = []
-
-    for species, percentage in zip(chosen_species, removal_percentages):
-        # Calculate the number of species to remove
-        num_species = structure.composition[species]
-        num_to_remove = int(num_species * (percentage / 100))
+    species = np.array([site.species_string for site in structure])
+    candidates = np.flatnonzero(np.isin(species, chosen_species))
+    position = {int(index): i for i, index in enumerate(candidates)}
+    offsets, neighbors, distances = neighbor_table(structure, candidates, further_radius)
+    further_counts = np.diff(offsets)
 
-        # Get indices of the chosen species
-        species_indices = [i for i, site in enumerate(structure) if site.species_string == species]
-        random.shuffle(species_indices)
+    keep = np.ones(len(structure), dtype=bool)
+    summary = {}
 
-        removed_count = 0
+    for chosen, percentage in zip(chosen_species, removal_percentages):
+        # Calculate the number of species to remove
+        species_indices = [int(i) for i in np.flatnonzero(species == chosen)]
+        num_to_remove = int(len(species_indices) * (percentage / 100))
+        rng.shuffle(species_indices)
 
-        while removed_count < num_to_remove and species_indices:
+        stats = {"considered": 0, "removed": 0, "rejected": 0, "immediate_neighbors": [], "further_neighbors": []}
+        while stats["removed"] < num_to_remove and species_indices:
             index = species_indices.pop()
+            p = position[index]
+            block = slice(offsets[p], offsets[p + 1])
+            present = keep[neighbors[block]]
+            immediate = present & (distances[block] <= max_distance + 1e-8)
+            stats["considered"] += 1
 
-            # Get immediate neighbors within max_distance
-            immediate_neighbors = structure.get_neighbors(structure[index], max_distance)
+            if log_neighbors:
+                print(f"\nConsidering removal of {chosen} atom at index {index} with neighbors:")
+                for neighbor, distance in zip(neighbors[block][immediate], distances[block][immediate]):
+                    print(f" - Neighbor at index {neighbor} ({species[neighbor]}), Distance: {distance:.2f} Å")
 
             # Ensure removing this atom won't create a large void
-            further_neighbors = structure.get_neighbors(structure[index], further_radius)
+            if further_counts[p] > 0:
+                keep[index] = False
+                for neighbor in neighbors[block]:
+                    q = position.get(int(neighbor))
+                    if q is not None:
+                        further_counts[q] -= 1
+                stats["removed"] += 1
+                stats["immediate_neighbors"].append(int(immediate.sum()))
+                stats["further_neighbors"].append(int(present.sum()))
+                if log_neighbors:
+                    print(f"Removal of {chosen} atom at index {index} accepted.\n")
+            else:
+                stats["rejected"] += 1
+                if log_neighbors:
+                    print(f"Removal of {chosen} atom at index {index} rejected due to void check.\n")
 
-            # Print information about the removal process
-            print(f"\nConsidering removal of {species} atom at index {index} with neighbors:")
+        summary[chosen] = stats
 
-            for neighbor in immediate_neighbors:
-                neighbor_site = neighbor.site
-                print(f" - Neighbor at index {structure.index(neighbor_site)} ({neighbor_site.species_string}), Distance: {neighbor.distance:.2f} Å")
+    structure.remove_sites(np.flatnonzero(~keep).tolist())
 
-            if len(further_neighbors) > 0:
-                indices_to_remove.append(index)
-                structure.remove_sites([index])  # Update structure immediately after removal
-                print(f"Removal of {species} atom at index {index} accepted.\n")
-                removed_count += 1
-            else:
-                print(f"Removal of {species} atom at index {index} rejected due to void check.\n")
-
-    removed_species_counts = {species: indices_to_remove.count(i) for species in chosen_species}
-    print(f"Removed species: {removed_species_counts}")
+    for chosen, stats in summary.items():
+        immediate = stats["immediate_neighbors"] or [0]
+        further = stats["further_neighbors"] or [0]
+        print(f"{chosen}: removed {stats['removed']} of {stats['considered']} considered "
+              f"({stats['rejected']} rejected by the void check); removed atoms had on average "
+              f"{np.mean(immediate):.2f} neighbors within {max_distance} Å and "
+              f"{np.mean(further):.2f} within {further_radius} Å")
+    print(f"Removed species: { {chosen: stats['removed'] for chosen, stats in summary.items()} }")
 
     return structure
 
-# Remove species simultaneously based on user input
-structure = remove_species_simultaneously(structure)
 
-# Save the modified structure to a new POSCAR file
-new_poscar_file = "Li2.8Zr0.8Cl6_modified.vasp"
-Poscar(structure).write_file(new_poscar_file)
+if __name__ == "__main__":
+    random.seed(random_seed)
+    structure = Poscar.from_file(poscar_file).structure
+
+    # Prompt user to choose species and specify the removal percentage for each
+    chosen_species = [sp.strip() for sp in input("Choose species to remove (comma-separated): ").split(',')]
+    removal_percentages = list(map(float, input("Enter removal percentages for each species (comma-separated): ").split(',')))
+    log_neighbors = input("Print the neighbors of every candidate? (yes/no): ").strip().lower() == 'yes'
+
+    # Remove species simultaneously based on user input
+    structure = remove_species_simultaneously(structure, chosen_species, removal_percentages, log_neighbors)
+
+    # Save the modified structure to a new POSCAR file
+    new_poscar_file = "Li2.8Zr0.8Cl6_modified.vasp"
+    Poscar(structure).write_file(new_poscar_file)
 
-# Print the reduced formula of the final structure
-reduced_formula = structure.composition.reduced_formula
-print("Species removal completed and saved to", new_poscar_file)
-print("Reduced formula of the final structure:", reduced_formula)
-print("Random seed used:", random_seed)
+    # Print the reduced formula of the final structure
+    reduced_formula = structure.composition.reduced_formula
+    print("Species removal completed and saved to", new_poscar_file)
+    print("Reduced formula of the final structure:", reduced_formula)
+    print("Random seed used:", random_seed)
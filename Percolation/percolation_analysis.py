@@ -0,0 +1,207 @@
+#   Percolation analysis of a chosen sublattice (or of its vacancies).
+#
+#   Sites of the chosen species are bonded when they are within 'cutoff' of
+#   each other (periodic boundaries). Clusters are found with a union-find that
+#   keeps the lattice image offset of every site relative to its cluster root,
+#   so a cluster that reconnects with a shifted copy of itself is known to wrap
+#   round the cell, i.e. to span it along that axis.
+#
+#   Run on a single POSCAR or on a directory of POSCARs (e.g. an ensemble from
+#   remove_ran_atoms_percent.py); over a directory the spanning probability
+#   against site fraction gives an estimate of the percolation threshold.
+
+import argparse
+import os
+from collections import Counter
+import numpy as np
+from pymatgen.core import Structure
+from pymatgen.optimization.neighbors import find_points_in_spheres
+
+axes = "abc"
+
+
+def sublattice_bonds(frac_coords, lattice, cutoff):
+    """
+    Periodic bonds between the given sites within cutoff (Angstrom).
+
+    Returns arrays (i, j, image) with each bond listed once: the image of site
+    j shifted by image (lattice vectors) is within cutoff of site i.
+    """
+    matrix = np.ascontiguousarray(lattice.matrix, dtype=float)
+    cart_coords = np.ascontiguousarray(np.mod(frac_coords, 1.0) @ matrix, dtype=float)
+    centers, points, images, distances = find_points_in_spheres(
+        cart_coords, cart_coords, r=float(cutoff), pbc=np.array([1, 1, 1], dtype=np.int64),
+        lattice=matrix, tol=1e-8)
+    images = images.astype(int)
+
+    # Keep one direction of every bond (self-images: the positive one)
+    positive_image = (images[:, 0] > 0) | ((images[:, 0] == 0) & ((images[:, 1] > 0)
+                                           | ((images[:, 1] == 0) & (images[:, 2] > 0))))
+    keep = (centers < points) | ((centers == points) & positive_image)
+    keep &= distances > 1e-8
+    return centers[keep], points[keep], images[keep]
+
+
+def periodic_clusters(n_sites, bonds):
+    """
+    Union-find over the bonds, tracking image offsets.
+
+    Returns the cluster label (root index) of every site, and a dict mapping each
+    root to the set of axes (0, 1, 2) along which that cluster wraps the cell.
+    """
+    parent = list(range(n_sites))
+    size = [1] * n_sites
+    offset = [(0, 0, 0)] * n_sites  # image of a site relative to its parent
+    wraps = {}
+
+    def find(x):
+        # Returns the root of x and x's image offset relative to the root
+        path = []
+        while parent[x] != x:
+            path.append(x)
+            x = parent[x]
+        root = x
+        shift = (0, 0, 0)
+        for node in reversed(path):
+            o = offset[node]
+            shift = (shift[0] + o[0], shift[1] + o[1], shift[2] + o[2])
+            parent[node] = root
+            offset[node] = shift
+        return root, (offset[path[0]] if path else (0, 0, 0))
+
+    for i, j, image in zip(*(np.asarray(b).tolist() for b in bonds)):
+        root_i, off_i = find(i)
+        root_j, off_j = find(j)
+        # Where site j has to sit, relative to root_i, for this bond to hold
+        target = (off_i[0] + image[0], off_i[1] + image[1], off_i[2] + image[2])
+        if root_i == root_j:
+            mismatch = [target[k] - off_j[k] for k in range(3)]
+            if any(mismatch):
+                wraps.setdefault(root_i, set()).update(k for k in range(3) if mismatch[k])
+            continue
+
+        # Shift of root_j relative to root_i
+        shift = (target[0] - off_j[0], target[1] - off_j[1], target[2] - off_j[2])
+        if size[root_i] < size[root_j]:
+            root_i, root_j = root_j, root_i
+            shift = (-shift[0], -shift[1], -shift[2])
+        parent[root_j] = root_i
+        offset[root_j] = shift
+        size[root_i] += size[root_j]
+        if root_j in wraps:
+            wraps.setdefault(root_i, set()).update(wraps.pop(root_j))
+
+    labels = np.array([find(x)[0] for x in range(n_sites)], dtype=int)
+    return labels, wraps
+
+
+def vacancy_coords(parent, structure, species, tol=0.5):
+    """
+    Fractional coordinates of the parent's species sites that are empty in structure.
+    """
+    matrix = np.ascontiguousarray(parent.lattice.matrix, dtype=float)
+    parent_sites = np.array([site.frac_coords for site in parent if site.species_string == species])
+    occupied = np.array([site.frac_coords for site in structure if site.species_string == species])
+    if len(occupied) == 0:
+        return parent_sites
+    centers, _, _, _ = find_points_in_spheres(
+        np.ascontiguousarray(np.mod(occupied, 1.0) @ matrix, dtype=float),
+        np.ascontiguousarray(np.mod(parent_sites, 1.0) @ matrix, dtype=float),
+        r=float(tol), pbc=np.array([1, 1, 1], dtype=np.int64), lattice=matrix, tol=1e-8)
+    empty = np.ones(len(parent_sites), dtype=bool)
+    empty[centers] = False
+    return parent_sites[empty]
+
+
+def analyse_structure(structure, species, cutoff, parent=None):
+    """
+    Cluster analysis of the species sublattice of structure, or of its
+    vacancies with respect to parent when parent is given.
+    """
+    if parent is None:
+        frac_coords = np.array([site.frac_coords for site in structure if site.species_string == species])
+    else:
+        frac_coords = vacancy_coords(parent, structure, species)
+    frac_coords = frac_coords.reshape(-1, 3)
+
+    labels, wraps = periodic_clusters(len(frac_coords), sublattice_bonds(frac_coords, structure.lattice, cutoff))
+    cluster_sizes = Counter(labels.tolist())
+    spanning = set().union(*wraps.values()) if wraps else set()
+    largest = max(cluster_sizes.values()) if cluster_sizes else 0
+    return {
+        "n_sites": len(frac_coords),
+        "n_clusters": len(cluster_sizes),
+        "largest_cluster": largest,
+        "size_distribution": dict(sorted(Counter(cluster_sizes.values()).items())),
+        "spanning_clusters": len(wraps),
+        "spans": {axes[k]: k in spanning for k in range(3)},
+    }
+
+
+def estimate_threshold(fractions, percolates):
+    """
+    Site fraction at which the spanning probability crosses 0.5, by linear
+    interpolation between the fractions sampled (None if it never crosses).
+    """
+    grouped = {}
+    for fraction, spans in zip(fractions, percolates):
+        grouped.setdefault(round(fraction, 6), []).append(spans)
+    points = sorted((fraction, np.mean(values)) for fraction, values in grouped.items())
+    for (p0, s0), (p1, s1) in zip(points, points[1:]):
+        if (s0 - 0.5) * (s1 - 0.5) <= 0 and s0 != s1:
+            return p0 + (0.5 - s0) * (p1 - p0) / (s1 - s0)
+    return None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Periodic percolation analysis of a sublattice.")
+    parser.add_argument("path", help="POSCAR file or directory of POSCARs")
+    parser.add_argument("--species", required=True, help="Species forming the sublattice, e.g. Li")
+    parser.add_argument("--cutoff", type=float, required=True, help="Bond cutoff between sites (Angstrom)")
+    parser.add_argument("--parent", help="Undiluted parent POSCAR; sets the total number of sublattice sites")
+    parser.add_argument("--vacancies", action="store_true", help="Analyse the vacancies instead (needs --parent)")
+    parser.add_argument("--output", default="percolation_summary.txt", help="Summary table")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.vacancies and not args.parent:
+        raise ValueError("--vacancies needs the --parent structure")
+
+    if os.path.isdir(args.path):
+        files = sorted(os.path.join(args.path, f) for f in os.listdir(args.path)
+                       if f.endswith(".vasp") or f.startswith("POSCAR"))
+    else:
+        files = [args.path]
+
+    parent = Structure.from_file(args.parent) if args.parent else None
+    total_sites = parent.composition[args.species] if parent else None
+
+    results = []
+    for filename in files:
+        structure = Structure.from_file(filename)
+        result = analyse_structure(structure, args.species, args.cutoff, parent if args.vacancies else None)
+        results.append((filename, result))
+        print(f"{os.path.basename(filename)}: {result['n_sites']} sites, {result['n_clusters']} clusters, "
+              f"largest {result['largest_cluster']}, spans {''.join(a for a, s in result['spans'].items() if s) or 'none'}")
+
+    # Fractions relative to the parent (or to the fullest structure analysed)
+    if total_sites is None:
+        total_sites = max(result["n_sites"] for _, result in results) or 1
+
+    with open(args.output, "w") as f:
+        f.write("Structure\tSites\tSite fraction\tClusters\tLargest cluster\tSpans a\tSpans b\tSpans c\tCluster sizes\n")
+        for filename, result in results:
+            spans = result["spans"]
+            f.write(f"{os.path.basename(filename)}\t{result['n_sites']}\t{result['n_sites'] / total_sites:.4f}\t"
+                    f"{result['n_clusters']}\t{result['largest_cluster']}\t{spans['a']}\t{spans['b']}\t{spans['c']}\t"
+                    f"{result['size_distribution']}\n")
+
+    if len(results) > 1:
+        fractions = [result["n_sites"] / total_sites for _, result in results]
+        for axis in axes:
+            threshold = estimate_threshold(fractions, [result["spans"][axis] for _, result in results])
+            print(f"Percolation threshold along {axis}: "
+                  f"{'not bracketed by the samples' if threshold is None else f'{threshold:.3f}'}")
+    print("Summary written to", args.output)
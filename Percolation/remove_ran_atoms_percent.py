@@ -1,26 +1,26 @@
 from pymatgen.io.vasp.inputs import Poscar
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import json
+import os
 import random
+import numpy as np
 
 # Set a random seed for reproducibility
 random_seed = 42
-random.seed(random_seed)
 
 # Load the input structure from POSCAR file
 poscar_file = "all_1_layer_Zr.vasp"
-structure = Poscar.from_file(poscar_file).structure
 
-def remove_species(structure):
-    # Prompt user to choose a species and specify the removal percentage
-    chosen_species = input("Choose a species to remove: ")
-    removal_percentage = float(input("Enter the removal percentage: "))
 
+def remove_species(structure, chosen_species, removal_percentage, rng=random):
     # Calculate the number of species to remove
     num_species = structure.composition[chosen_species]
     num_to_remove = int(num_species * (removal_percentage / 100))
 
     # Get indices of the chosen species
     species_indices = [i for i, site in enumerate(structure) if site.species_string == chosen_species]
-    random.shuffle(species_indices)
+    rng.shuffle(species_indices)
 
     # Remove the specified percentage of the chosen species
     indices_to_remove = species_indices[:num_to_remove]
@@ -30,19 +30,140 @@ def remove_species(structure):
 
     return structure
 
-# Remove species in a loop until the user decides to stop
-while True:
-    structure = remove_species(structure)
-    more_removals = input("Do you want to remove another species? (yes/no): ").strip().lower()
-    if more_removals != 'yes':
-        break
-
-# Save the modified structure to a new POSCAR file
-new_poscar_file = "0.66_Zr.vasp"
-Poscar(structure).write_file(new_poscar_file)
-
-# Print the reduced formula of the final structure
-reduced_formula = structure.composition.reduced_formula
-print("Species removal completed and saved to", new_poscar_file)
-print("Reduced formula of the final structure:", reduced_formula)
-print("Random seed used:", random_seed)
+
+def sweep_removal(structure, chosen_species, percentages, output_dir="sweep", rng=random):
+    """
+    Write nested configurations for a list of removal percentages from one
+    shuffle of the species: each level removes the next atoms of the same
+    order, so level k is the structure remove_species gives for that
+    percentage with the same seed.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    species_indices = [i for i, site in enumerate(structure) if site.species_string == chosen_species]
+    rng.shuffle(species_indices)
+
+    written = []
+    for percentage in sorted(percentages):
+        num_to_remove = int(len(species_indices) * (percentage / 100))
+        level = structure.copy()
+        level.remove_sites(species_indices[:num_to_remove])
+        filename = os.path.join(output_dir, f"{chosen_species}_{percentage:g}pct.vasp")
+        Poscar(level).write_file(filename)
+        written.append(filename)
+        print(f"{percentage:g}%: removed {num_to_remove} {chosen_species}, "
+              f"{level.composition.reduced_formula} -> {filename}")
+    return written
+
+
+# Parent structure shared with the worker processes (set by _init_worker)
+_parent = {}
+
+
+def _init_worker(structure):
+    _parent["structure"] = structure
+
+
+def _make_sample(task):
+    """
+    Build one ensemble member. task is (sample number, seed sequence, targets, output file).
+    """
+    number, seed_sequence, targets, filename = task
+    rng = np.random.default_rng(seed_sequence)
+    structure = _parent["structure"].copy()
+    indices_to_remove = []
+    for chosen_species, removal_percentage in targets:
+        species_indices = [i for i, site in enumerate(structure) if site.species_string == chosen_species]
+        num_to_remove = int(len(species_indices) * (removal_percentage / 100))
+        indices_to_remove.extend(int(i) for i in rng.permutation(species_indices)[:num_to_remove])
+    structure.remove_sites(sorted(indices_to_remove))
+    Poscar(structure).write_file(filename)
+    return number, structure.composition.reduced_formula
+
+
+def generate_ensemble(structure, targets, n_samples, seed=random_seed, output_dir="ensemble", workers=None):
+    """
+    Write n_samples independent random vacancy configurations of structure.
+
+    targets is a list of (species, removal percentage). Each sample gets its own
+    child of numpy's SeedSequence(seed), so the samples are independent and any
+    one of them can be regenerated from (seed, sample number) alone. The parent
+    structure is parsed once and handed to each worker when the pool starts.
+    A manifest.json with the seeds and targets is written next to the POSCARs.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    children = np.random.SeedSequence(seed).spawn(n_samples)
+    width = len(str(max(n_samples - 1, 0)))
+    tasks = [(n, child, targets, os.path.join(output_dir, f"sample_{n:0{width}d}.vasp"))
+             for n, child in enumerate(children)]
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(structure,)) as pool:
+        formulas = dict(pool.map(_make_sample, tasks))
+
+    manifest = {
+        "parent": structure.composition.reduced_formula,
+        "targets": [[species, percentage] for species, percentage in targets],
+        "seed": seed,
+        "samples": [
+            {"file": os.path.basename(filename), "spawn_key": list(child.spawn_key),
+             "reduced_formula": formulas[n]}
+            for n, child, _, filename in tasks
+        ],
+    }
+    with open(os.path.join(output_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    print(f"Wrote {n_samples} configurations to {output_dir} (seed {seed})")
+    return manifest
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Randomly remove a percentage of chosen species. "
+                                                 "Without --target or --sweep the removals are prompted for.")
+    parser.add_argument("--input", default=poscar_file, help="Parent POSCAR")
+    parser.add_argument("--target", nargs=2, action="append", metavar=("SPECIES", "PERCENT"),
+                        help="Species and removal percentage, may be repeated")
+    parser.add_argument("--samples", type=int, default=1, help="Number of ensemble members")
+    parser.add_argument("--seed", type=int, default=random_seed, help="Random seed (root seed in ensemble mode)")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")
+    parser.add_argument("--species", help="Species to remove in the sweep")
+    parser.add_argument("--sweep", type=float, nargs=3, metavar=("START", "STOP", "STEP"),
+                        help="Removal percentages for the sweep, STOP included")
+    parser.add_argument("--output-dir", help="Directory for the POSCARs (default ensemble/ or sweep/)")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    structure = Poscar.from_file(args.input).structure
+
+    if args.target:
+        targets = [(species, float(percentage)) for species, percentage in args.target]
+        generate_ensemble(structure, targets, args.samples, args.seed, args.output_dir or "ensemble", args.workers)
+    elif args.sweep:
+        if not args.species:
+            raise ValueError("--sweep needs the --species to remove")
+        random.seed(args.seed)
+        start, stop, step = args.sweep
+        sweep_removal(structure, args.species, np.arange(start, stop + step / 2, step), args.output_dir or "sweep")
+        print("Random seed used:", args.seed)
+    else:
+        random.seed(args.seed)
+
+        # Remove species in a loop until the user decides to stop
+        while True:
+            chosen_species = input("Choose a species to remove: ")
+            removal_percentage = float(input("Enter the removal percentage: "))
+            structure = remove_species(structure, chosen_species, removal_percentage)
+            more_removals = input("Do you want to remove another species? (yes/no): ").strip().lower()
+            if more_removals != 'yes':
+                break
+
+        # Save the modified structure to a new POSCAR file
+        new_poscar_file = "0.66_Zr.vasp"
+        Poscar(structure).write_file(new_poscar_file)
+
+        # Print the reduced formula of the final structure
+        reduced_formula = structure.composition.reduced_formula
+        print("Species removal completed and saved to", new_poscar_file)
+        print("Reduced formula of the final structure:", reduced_formula)
+        print("Random seed used:", args.seed)
@@ -0,0 +1,111 @@
+#   Structure-aware selection of MD frames.
+#
+#   Each frame is reduced to a cheap radial fingerprint: a histogram of the
+#   interatomic distances up to 'cutoff' for every species pair, per centre
+#   atom. Frames are then picked by farthest-point sampling (each new frame is
+#   the one furthest from all frames already picked) or by k-means (the frame
+#   closest to each cluster centre), so near-identical configurations are not
+#   sent to relaxation twice.
+
+import numpy as np
+from itertools import combinations_with_replacement
+from pymatgen.optimization.neighbors import find_points_in_spheres
+from scipy.cluster.vq import kmeans2
+
+
+def radial_fingerprint(frac_coords, lattice, species, cutoff=6.0, n_bins=60):
+    """
+    Distance histograms (one per species pair, concatenated) of a frame,
+    normalised by the number of atoms of the centre species.
+    """
+    names = sorted(set(species))
+    codes = np.searchsorted(names, species)
+    pairs = {pair: i for i, pair in enumerate(combinations_with_replacement(range(len(names)), 2))}
+    pair_index = np.full((len(names), len(names)), -1)
+    for (a, b), i in pairs.items():
+        pair_index[a, b] = pair_index[b, a] = i
+
+    matrix = np.ascontiguousarray(lattice, dtype=float)
+    cart_coords = np.ascontiguousarray(np.mod(frac_coords, 1.0) @ matrix, dtype=float)
+    centers, points, _, distances = find_points_in_spheres(
+        cart_coords, cart_coords, r=float(cutoff), pbc=np.array([1, 1, 1], dtype=np.int64),
+        lattice=matrix, tol=1e-8)
+    keep = distances > 1e-8
+    centers, points, distances = centers[keep], points[keep], distances[keep]
+
+    bins = np.minimum((distances / cutoff * n_bins).astype(int), n_bins - 1)
+    index = pair_index[codes[centers], codes[points]] * n_bins + bins
+    histogram = np.bincount(index, minlength=len(pairs) * n_bins).astype(float)
+    n_centers = np.bincount(codes, minlength=len(names))
+    for (a, b), i in pairs.items():
+        histogram[i * n_bins:(i + 1) * n_bins] /= max(n_centers[a] + (n_centers[b] if a != b else 0), 1)
+    return histogram
+
+
+def trajectory_fingerprints(trajectory, stride=1, cutoff=6.0, n_bins=60):
+    """
+    Fingerprints of every stride-th frame of a trajectory (streamed).
+
+    Returns the frame indices and an array (n_frames, n_features).
+    """
+    frames = []
+    fingerprints = []
+    for frame in trajectory.iter_frames(stride=stride):
+        frames.append(frame.index)
+        fingerprints.append(radial_fingerprint(frame.frac_coords, frame.lattice, trajectory.species, cutoff, n_bins))
+    return np.array(frames), np.array(fingerprints)
+
+
+def farthest_point_selection(fingerprints, n_select, first=0):
+    """
+    Farthest-point sampling. Returns the selected rows, in selection order,
+    and the distance of each to the closest previously selected row at the
+    time it was picked (0 for the first).
+    """
+    n_select = min(n_select, len(fingerprints))
+    selected = [first]
+    picked_distances = [0.0]
+    closest = np.linalg.norm(fingerprints - fingerprints[first], axis=1)
+    for _ in range(n_select - 1):
+        row = int(np.argmax(closest))
+        selected.append(row)
+        picked_distances.append(float(closest[row]))
+        closest = np.minimum(closest, np.linalg.norm(fingerprints - fingerprints[row], axis=1))
+    return np.array(selected), np.array(picked_distances)
+
+
+def kmeans_selection(fingerprints, n_select, seed=0):
+    """
+    k-means on the fingerprints. Returns the row closest to each cluster
+    centre, and its distance to the nearest other selected row.
+    """
+    n_select = min(n_select, len(fingerprints))
+    centroids, labels = kmeans2(fingerprints, n_select, minit="++", seed=seed)
+    selected = []
+    for k in range(n_select):
+        members = np.flatnonzero(labels == k)
+        if len(members) == 0:
+            continue
+        distances = np.linalg.norm(fingerprints[members] - centroids[k], axis=1)
+        selected.append(int(members[np.argmin(distances)]))
+    selected = np.array(sorted(set(selected)))
+
+    chosen = fingerprints[selected]
+    separation = np.linalg.norm(chosen[:, None, :] - chosen[None, :, :], axis=-1)
+    np.fill_diagonal(separation, np.inf)
+    return selected, separation.min(axis=1) if len(selected) > 1 else np.zeros(len(selected))
+
+
+def select_frames(trajectory, n_select, method="fps", stride=1, cutoff=6.0, n_bins=60):
+    """
+    Pick the n_select most distinct frames of a trajectory.
+
+    Returns the frame indices and the fingerprint distance reported by the
+    selection method for each of them.
+    """
+    frames, fingerprints = trajectory_fingerprints(trajectory, stride, cutoff, n_bins)
+    if method == "kmeans":
+        rows, distances = kmeans_selection(fingerprints, n_select)
+    else:
+        rows, distances = farthest_point_selection(fingerprints, n_select)
+    return frames[rows], distances
@@ -0,0 +1,220 @@
+#   Mean-squared displacement and diffusion coefficients from MD trajectories.
+#
+#   The trajectory (XDATCAR, or a binary trajectory from trajectory.py) is
+#   unwrapped across periodic boundaries and the MSD of each species is
+#   computed over all time origins with the FFT autocorrelation method,
+#   O(T log T) per atom instead of O(T^2). Atoms are processed in chunks so
+#   that long runs fit in memory; an XDATCAR is first streamed into a
+#   temporary binary trajectory, and the unwrapped positions of a species are
+#   written atom-major to a scratch file in one pass over it, so each chunk
+#   is read contiguously.
+#
+#   D is fitted to MSD = 6 D t over a window of time lags, with an error from
+#   block averaging (the run is split into blocks and D fitted in each), and
+#   converted to an ionic conductivity with the Nernst-Einstein relation.
+#
+#   Usage: python md_diffusion.py XDATCAR --species Li --timestep 2 --step-skip 1 --temperature 600
+
+import argparse
+import os
+import tempfile
+import numpy as np
+from trajectory import open_trajectory, convert_xdatcar, BinaryTrajectory
+
+# Physical constants (SI)
+elementary_charge = 1.602176634e-19
+boltzmann = 1.380649e-23
+
+
+def msd_fft(positions):
+    """
+    MSD over all time origins for each atom, summed over x, y, z.
+
+    positions has shape (T, n_atoms, 3); returns an array (T, n_atoms) with the
+    MSD at every time lag. Uses MSD(m) = S1(m) - 2 S2(m), where S2 is the
+    positional autocorrelation (by FFT) and S1 follows from cumulative sums.
+    """
+    n_frames = positions.shape[0]
+    lags = np.arange(n_frames)
+    counts = (n_frames - lags)[:, None]
+
+    spectrum = np.fft.rfft(positions, n=2 * n_frames, axis=0)
+    autocorrelation = np.fft.irfft(spectrum * spectrum.conj(), axis=0)[:n_frames].sum(axis=-1)
+    s2 = autocorrelation / counts
+
+    squared = np.sum(positions ** 2, axis=-1)
+    total = 2 * squared.sum(axis=0)
+    head = np.concatenate([np.zeros((1, squared.shape[1])), np.cumsum(squared, axis=0)[:-1]])
+    tail = np.concatenate([np.zeros((1, squared.shape[1])), np.cumsum(squared[::-1], axis=0)[:-1]])
+    s1 = (total - head - tail) / counts
+    return s1 - 2 * s2
+
+
+def unwrapped_blocks(trajectory, atoms, drift=None, memory=512e6):
+    """
+    Unwrapped cartesian positions relative to the first frame, built from the
+    wrapped fractional coordinates of a BinaryTrajectory and yielded as
+    (frames, positions (n_block, len(atoms), 3)) over contiguous frame blocks,
+    so the frame-major file is read once, in order. The fractional jump
+    between frames is folded into [-0.5, 0.5) and converted with the cell of
+    the later frame. drift (T, 3) is subtracted if given.
+    """
+    n_frames = trajectory.n_frames
+    block_size = max(1, int(memory // (max(len(atoms), 1) * 3 * 8 * 4)))
+    previous_frac = None
+    previous_position = np.zeros((len(atoms), 3))
+    for start in range(0, n_frames, block_size):
+        frames = slice(start, min(start + block_size, n_frames))
+        frac = np.asarray(trajectory.frac_coords(frames, atoms), dtype=float)
+        if previous_frac is None:
+            previous_frac = frac[0]
+        jumps = np.diff(np.concatenate([previous_frac[None], frac]), axis=0)
+        jumps -= np.round(jumps)
+        steps = np.einsum("tij,tjk->tik", jumps, trajectory.lattices[frames])
+        positions = previous_position + np.cumsum(steps, axis=0)
+        previous_frac, previous_position = frac[-1], positions[-1]
+        if drift is not None:
+            positions -= drift[frames, None, :]
+        yield frames, positions
+
+
+def atom_chunks(atoms, n_frames, chunk_size=None, memory=512e6):
+    """
+    Split atom indices into chunks whose FFT work arrays fit in about memory bytes.
+    """
+    if chunk_size is None:
+        chunk_size = max(1, int(memory // (n_frames * 3 * 8 * 8)))
+    return [atoms[i:i + chunk_size] for i in range(0, len(atoms), chunk_size)]
+
+
+def framework_drift(trajectory, atoms):
+    """
+    Mean unwrapped displacement (T, 3) of the given (framework) atoms.
+    """
+    drift = np.zeros((trajectory.n_frames, 3))
+    for frames, positions in unwrapped_blocks(trajectory, atoms):
+        drift[frames] = positions.mean(axis=1)
+    return drift
+
+
+def fit_diffusivity(time, msd, fit_range=(0.1, 0.5)):
+    """
+    D (A^2/ps) from a linear fit of MSD = 6 D t + c over the fraction fit_range
+    of the time lags.
+    """
+    n = len(time)
+    window = slice(max(1, int(fit_range[0] * n)), max(2, int(fit_range[1] * n)))
+    slope, _ = np.polyfit(time[window], msd[window], 1)
+    return slope / 6
+
+
+def species_msd(trajectory, atoms, drift=None, n_blocks=5, chunk_size=None):
+    """
+    Species-averaged MSD over the whole run (T,) and over each of n_blocks
+    contiguous blocks (n_blocks, T // n_blocks), accumulated over atom chunks.
+
+    The unwrapped positions are first written atom-major, (len(atoms), T, 3),
+    to a temporary file in one pass over the trajectory, so every chunk is a
+    contiguous read instead of a strided read through all the frames.
+    """
+    n_frames = trajectory.n_frames
+    block_length = n_frames // n_blocks if n_blocks else 0
+    msd = np.zeros(n_frames)
+    block_msd = np.zeros((n_blocks, block_length))
+    with tempfile.TemporaryDirectory() as scratch:
+        unwrapped = np.lib.format.open_memmap(os.path.join(scratch, "unwrapped.npy"), mode="w+",
+                                              dtype=float, shape=(len(atoms), n_frames, 3))
+        for frames, positions in unwrapped_blocks(trajectory, atoms, drift):
+            unwrapped[:, frames] = positions.transpose(1, 0, 2)
+
+        for chunk in atom_chunks(np.arange(len(atoms)), n_frames, chunk_size):
+            positions = np.array(unwrapped[chunk[0]:chunk[-1] + 1]).transpose(1, 0, 2)
+            msd += msd_fft(positions).sum(axis=1)
+            for b in range(n_blocks if block_length > 2 else 0):
+                block = positions[b * block_length:(b + 1) * block_length]
+                block_msd[b] += msd_fft(block - block[0]).sum(axis=1)
+        del unwrapped
+    return msd / len(atoms), block_msd / len(atoms)
+
+
+def nernst_einstein(diffusivity, n_ions, volume, temperature, charge=1):
+    """
+    Conductivity (S/cm) from D (A^2/ps), the number of ions in the cell volume (A^3).
+    """
+    d_si = diffusivity * 1e-20 / 1e-12
+    density = n_ions / (volume * 1e-30)
+    return density * (charge * elementary_charge) ** 2 * d_si / (boltzmann * temperature) / 100
+
+
+def diffusion_analysis(path, species, timestep, step_skip=1, temperature=None, charges=None,
+                       fit_range=(0.1, 0.5), n_blocks=5, chunk_size=None, remove_drift=True):
+    """
+    MSD, diffusivity and conductivity of each species in a trajectory.
+
+    timestep is the MD time step in fs and step_skip the number of MD steps
+    between frames. Returns {species: result dict}.
+    """
+    with tempfile.TemporaryDirectory() as scratch:
+        trajectory = open_trajectory(path)
+        if not isinstance(trajectory, BinaryTrajectory):
+            # Stream the XDATCAR into a memory-mapped binary trajectory first
+            trajectory = BinaryTrajectory(convert_xdatcar(path, os.path.join(scratch, "trajectory")))
+
+        all_species = np.array(trajectory.species)
+        framework = np.flatnonzero(~np.isin(all_species, species))
+        drift = framework_drift(trajectory, framework) if remove_drift and len(framework) else None
+
+        time = np.arange(trajectory.n_frames) * timestep * step_skip / 1000  # ps
+        volume = np.mean(np.abs(np.linalg.det(trajectory.lattices)))
+        results = {}
+        for sp in species:
+            atoms = np.flatnonzero(all_species == sp)
+            msd, block_msd = species_msd(trajectory, atoms, drift, n_blocks, chunk_size)
+            diffusivity = fit_diffusivity(time, msd, fit_range)
+            block_d = [fit_diffusivity(time[:block_msd.shape[1]], m, fit_range) for m in block_msd] \
+                if block_msd.shape[1] > 2 else []
+            error = np.std(block_d, ddof=1) / np.sqrt(len(block_d)) if len(block_d) > 1 else float("nan")
+
+            result = {"time": time, "msd": msd, "D": diffusivity, "D_error": error, "n_atoms": len(atoms)}
+            if temperature:
+                charge = (charges or {}).get(sp, 1)
+                result["conductivity"] = nernst_einstein(diffusivity, len(atoms), volume, temperature, charge)
+                result["conductivity_error"] = nernst_einstein(error, len(atoms), volume, temperature, charge)
+            results[sp] = result
+        return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="FFT mean-squared displacement and diffusion coefficients.")
+    parser.add_argument("trajectory", nargs="?", default="XDATCAR", help="XDATCAR or binary trajectory directory")
+    parser.add_argument("--species", nargs="+", required=True, help="Diffusing species, e.g. Li")
+    parser.add_argument("--timestep", type=float, required=True, help="MD time step (fs)")
+    parser.add_argument("--step-skip", type=int, default=1, help="MD steps between XDATCAR frames (NBLOCK)")
+    parser.add_argument("--temperature", type=float, help="Temperature (K) for the Nernst-Einstein conductivity")
+    parser.add_argument("--charge", nargs=2, action="append", metavar=("SPECIES", "Z"),
+                        help="Ionic charge of a species (default 1), may be repeated")
+    parser.add_argument("--fit-range", type=float, nargs=2, default=(0.1, 0.5), metavar=("START", "END"),
+                        help="Fraction of the time lags used for the fit")
+    parser.add_argument("--blocks", type=int, default=5, help="Number of blocks for the error estimate")
+    parser.add_argument("--chunk-size", type=int, help="Atoms per FFT chunk (default from a memory budget)")
+    parser.add_argument("--keep-drift", action="store_true", help="Do not subtract the framework drift")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    charges = {sp: float(z) for sp, z in args.charge} if args.charge else None
+    results = diffusion_analysis(args.trajectory, args.species, args.timestep, args.step_skip, args.temperature,
+                                 charges, tuple(args.fit_range), args.blocks, args.chunk_size, not args.keep_drift)
+
+    for sp, result in results.items():
+        # A^2/ps -> cm^2/s
+        print(f"{sp} ({result['n_atoms']} atoms): D = {result['D'] * 1e-4:.3e} "
+              f"+/- {result['D_error'] * 1e-4:.1e} cm^2/s")
+        if "conductivity" in result:
+            print(f"    sigma = {result['conductivity'] * 1e3:.3e} +/- {result['conductivity_error'] * 1e3:.1e} mS/cm")
+        with open(f"msd_{sp}.txt", "w") as f:
+            f.write("Time (ps)\tMSD (A^2)\n")
+            for t, m in zip(result["time"], result["msd"]):
+                f.write(f"{t:.4f}\t{m:.6f}\n")
+        print(f"    MSD written to msd_{sp}.txt")
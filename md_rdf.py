@@ -0,0 +1,197 @@
+#   Radial distribution functions and coordination numbers from MD trajectories.
+#
+#   Frames of an XDATCAR (or a binary trajectory from trajectory.py) are
+#   processed one at a time: the neighbours within r_max of every atom are found
+#   with pymatgen's periodic cell-list search and binned into a fixed-size
+#   distance histogram for each species pair, so memory does not grow with
+#   the length of the run. With --workers the frames are split into contiguous
+#   ranges, each worker reads its own range by seeking through the frame index,
+#   and the partial histograms are summed at the end.
+#
+#   For each centre-neighbour pair A-B the output is g(r), the running
+#   coordination number n(r) (the mean number of B within r of an A), and,
+#   with --cn-cutoff, the histogram of the number of B around each A in the
+#   first shell.
+#
+#   Usage: python md_rdf.py XDATCAR --pairs Li-Cl Li-Li --r-max 8 --cn-cutoff 3.2
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from pymatgen.optimization.neighbors import find_points_in_spheres
+from trajectory import open_trajectory
+
+# Largest coordination number kept in the histograms
+max_coordination = 24
+
+
+def frame_histograms(frac_coords, lattice, codes, n_species, r_max, n_bins, cn_cutoff=None):
+    """
+    Distance histogram (n_species, n_species, n_bins) of one frame, counting
+    for every atom of species a (first index) the neighbours of species b,
+    and, if cn_cutoff is given, the number of b within cn_cutoff of each atom
+    as an array (n_atoms, n_species).
+    """
+    matrix = np.ascontiguousarray(lattice, dtype=float)
+    cart_coords = np.ascontiguousarray(np.mod(frac_coords, 1.0) @ matrix, dtype=float)
+    centers, points, _, distances = find_points_in_spheres(
+        cart_coords, cart_coords, r=float(r_max), pbc=np.array([1, 1, 1], dtype=np.int64),
+        lattice=matrix, tol=1e-8)
+    keep = (distances > 1e-8) & (distances < r_max)
+    centers, points, distances = centers[keep], points[keep], distances[keep]
+
+    bins = (distances / r_max * n_bins).astype(int)
+    index = (codes[centers] * n_species + codes[points]) * n_bins + bins
+    counts = np.bincount(index, minlength=n_species * n_species * n_bins).reshape(n_species, n_species, n_bins)
+
+    coordination = None
+    if cn_cutoff is not None:
+        shell = distances < cn_cutoff
+        coordination = np.bincount(centers[shell] * n_species + codes[points[shell]],
+                                   minlength=len(codes) * n_species).reshape(len(codes), n_species)
+    return counts, coordination
+
+
+class RDFAccumulator:
+    """
+    Running sums of the pair histograms over frames. Two accumulators over
+    different frames of the same trajectory are combined with add().
+    """
+
+    def __init__(self, species, r_max=8.0, n_bins=200, cn_cutoff=None):
+        self.names = sorted(set(species))
+        self.codes = np.searchsorted(self.names, species)
+        self.n_atoms = np.bincount(self.codes, minlength=len(self.names))
+        self.r_max = r_max
+        self.n_bins = n_bins
+        self.cn_cutoff = cn_cutoff
+        n = len(self.names)
+        self.counts = np.zeros((n, n, n_bins), dtype=np.int64)
+        # Sum over frames of N_a * N_b / V, the normalisation of g(r)
+        self.pair_density = np.zeros((n, n))
+        self.coordination = np.zeros((n, n, max_coordination + 1), dtype=np.int64)
+        self.n_frames = 0
+
+    def add_frame(self, frac_coords, lattice):
+        n = len(self.names)
+        counts, coordination = frame_histograms(frac_coords, lattice, self.codes, n, self.r_max, self.n_bins,
+                                                self.cn_cutoff)
+        self.counts += counts
+        volume = abs(np.linalg.det(lattice))
+        self.pair_density += self.n_atoms[:, None] * (self.n_atoms[None, :] - np.eye(n)) / volume
+        if coordination is not None:
+            coordination = np.minimum(coordination, max_coordination)
+            for a in range(n):
+                for b in range(n):
+                    self.coordination[a, b] += np.bincount(coordination[self.codes == a, b],
+                                                           minlength=max_coordination + 1)
+        self.n_frames += 1
+
+    def add(self, other):
+        self.counts += other.counts
+        self.pair_density += other.pair_density
+        self.coordination += other.coordination
+        self.n_frames += other.n_frames
+        return self
+
+    @property
+    def r(self):
+        """
+        Bin centres (A).
+        """
+        edges = np.linspace(0, self.r_max, self.n_bins + 1)
+        return (edges[1:] + edges[:-1]) / 2
+
+    def pair(self, a, b):
+        """
+        g(r), running coordination number n(r) and the first-shell coordination
+        histogram (fraction of A atoms with 0, 1, 2, ... B neighbours) of pair a-b.
+        """
+        i, j = self.names.index(a), self.names.index(b)
+        edges = np.linspace(0, self.r_max, self.n_bins + 1)
+        shell_volume = 4 / 3 * np.pi * (edges[1:] ** 3 - edges[:-1] ** 3)
+        counts = self.counts[i, j]
+        g = counts / (self.pair_density[i, j] * shell_volume) if self.pair_density[i, j] else np.zeros(self.n_bins)
+        running = np.cumsum(counts) / (self.n_atoms[i] * self.n_frames)
+        histogram = self.coordination[i, j] / max(self.coordination[i, j].sum(), 1)
+        return g, running, histogram
+
+
+_shared = {}
+
+
+def _init_worker(path, r_max, n_bins, cn_cutoff):
+    _shared["trajectory"] = open_trajectory(path)
+    _shared["settings"] = (r_max, n_bins, cn_cutoff)
+
+
+def _accumulate_range(frames):
+    trajectory = _shared["trajectory"]
+    accumulator = RDFAccumulator(trajectory.species, *_shared["settings"])
+    for frame in trajectory.read_frames(frames):
+        accumulator.add_frame(frame.frac_coords, frame.lattice)
+    return accumulator
+
+
+def rdf_analysis(path, r_max=8.0, n_bins=200, cn_cutoff=None, start=0, stop=None, stride=1, workers=1,
+                 chunk_size=200):
+    """
+    Accumulate the pair histograms of frames start:stop:stride of a trajectory,
+    serially or over worker processes, and return the RDFAccumulator.
+    """
+    trajectory = open_trajectory(path)
+    if workers == 1:
+        accumulator = RDFAccumulator(trajectory.species, r_max, n_bins, cn_cutoff)
+        for frame in trajectory.iter_frames(start, stop, stride):
+            accumulator.add_frame(frame.frac_coords, frame.lattice)
+        return accumulator
+
+    # Building the frame index here writes the sidecar the workers then read
+    frames = range(*slice(start, stop, stride).indices(trajectory.n_frames))
+    chunks = [frames[i:i + chunk_size] for i in range(0, len(frames), chunk_size)]
+    accumulator = RDFAccumulator(trajectory.species, r_max, n_bins, cn_cutoff)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(os.path.abspath(path), r_max, n_bins, cn_cutoff)) as pool:
+        for partial in pool.map(_accumulate_range, chunks):
+            accumulator.add(partial)
+    return accumulator
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Streaming RDF and coordination numbers from an MD trajectory.")
+    parser.add_argument("trajectory", nargs="?", default="XDATCAR", help="XDATCAR or binary trajectory directory")
+    parser.add_argument("--pairs", nargs="+", help="Centre-neighbour pairs, e.g. Li-Cl Li-Li (default: all)")
+    parser.add_argument("--r-max", type=float, default=8.0, help="Largest distance (A)")
+    parser.add_argument("--bins", type=int, default=200, help="Number of distance bins")
+    parser.add_argument("--cn-cutoff", type=float, help="First-shell radius (A) for the coordination histograms")
+    parser.add_argument("--start", type=int, default=0, help="First frame (e.g. to skip equilibration)")
+    parser.add_argument("--stride", type=int, default=1, help="Use every n-th frame")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    accumulator = rdf_analysis(args.trajectory, args.r_max, args.bins, args.cn_cutoff, args.start, None,
+                               args.stride, args.workers)
+    names = accumulator.names
+    pairs = [pair.split("-") for pair in args.pairs] if args.pairs else \
+        [(a, b) for i, a in enumerate(names) for b in names[i:]]
+    print(f"{accumulator.n_frames} frames analysed")
+
+    for a, b in pairs:
+        g, running, histogram = accumulator.pair(a, b)
+        with open(f"rdf_{a}-{b}.txt", "w") as f:
+            f.write("r (A)\tg(r)\tn(r)\n")
+            for r, g_r, n_r in zip(accumulator.r, g, running):
+                f.write(f"{r:.4f}\t{g_r:.6f}\t{n_r:.6f}\n")
+        print(f"{a}-{b}: first peak at {accumulator.r[np.argmax(g)]:.2f} A, written to rdf_{a}-{b}.txt")
+
+        if args.cn_cutoff is not None:
+            with open(f"cn_{a}-{b}.txt", "w") as f:
+                f.write("Coordination number\tFraction\n")
+                for n, fraction in enumerate(histogram):
+                    f.write(f"{n}\t{fraction:.6f}\n")
+            mean = np.dot(np.arange(len(histogram)), histogram)
+            print(f"    mean coordination within {args.cn_cutoff} A: {mean:.3f}, written to cn_{a}-{b}.txt")
@@ -0,0 +1,219 @@
+#   Interstitial site occupancy and hopping from MD trajectories.
+#
+#   The sites are the tetrahedral and octahedral holes written by
+#   Find_all_sites/find_all_tet_oct_sites.py: its output POSCAR holds the host
+#   structure followed by the tetrahedral and then the octahedral sites, each
+#   filled with the species chosen there. A KD-tree over the cartesian site
+#   positions and their 26 neighbouring periodic images is built once, and
+#   every mobile ion of every frame is assigned to its nearest site with one
+#   query per block of frames. Ion positions are mapped through fractional
+#   coordinates onto the cell of the site file, so variable-cell runs are
+#   handled without rebuilding the tree.
+#
+#   Occupancy, residence times and a site-to-site hop count matrix are
+#   accumulated frame by frame, so memory does not depend on the run length.
+#   With --capture-radius an ion is only moved to a new site once it is within
+#   that distance of it, which stops vibrations near a shared face being
+#   counted as hops.
+#
+#   Usage: python md_site_occupancy.py XDATCAR --sites structure_with_added_atoms.vasp --host Cu_missing.vasp \
+#              --tet-species Cu --oct-species Ag --mobile Cu
+
+import argparse
+import numpy as np
+from itertools import product
+from scipy.spatial import cKDTree
+from pymatgen.core import Structure
+from trajectory import open_trajectory
+
+
+def load_sites(filename, n_host, tet_species, oct_species=None):
+    """
+    Fractional coordinates, types ("tet"/"oct") and the lattice of the
+    interstitial sites in a find_all_tet_oct_sites.py output. The first n_host
+    sites are the host structure and are skipped; the rest are told apart by
+    species, so the tetrahedral and octahedral species must differ.
+    """
+    if tet_species == oct_species:
+        raise ValueError(f"Tetrahedral and octahedral sites both hold {tet_species}, they cannot be told apart; "
+                         "rerun find_all_tet_oct_sites.py with different species")
+    structure = Structure.from_file(filename)
+    frac_coords, types = [], []
+    for site in structure.sites[n_host:]:
+        symbol = site.species.elements[0].symbol
+        if symbol == tet_species:
+            site_type = "tet"
+        elif symbol == oct_species:
+            site_type = "oct"
+        else:
+            raise ValueError(f"Site {site} after the {n_host} host sites is neither {tet_species} nor "
+                             f"{oct_species}; is --host the structure given to find_all_tet_oct_sites.py?")
+        frac_coords.append(site.frac_coords)
+        types.append(site_type)
+    return np.mod(np.array(frac_coords), 1.0), types, structure.lattice.matrix
+
+
+class SiteTree:
+    """
+    Nearest-site lookup with periodic boundaries, built once for a set of sites.
+    """
+
+    def __init__(self, frac_coords, lattice):
+        self.lattice = np.asarray(lattice, dtype=float)
+        self.n_sites = len(frac_coords)
+        images = np.array(list(product((-1, 0, 1), repeat=3)))
+        # Row k of the tree is site k % n_sites in image k // n_sites
+        all_frac = (frac_coords[None, :, :] + images[:, None, :]).reshape(-1, 3)
+        self.tree = cKDTree(all_frac @ self.lattice)
+
+    def nearest(self, frac_coords):
+        """
+        Nearest site and its distance (A) for fractional coordinates (..., 3).
+        """
+        cart_coords = np.mod(frac_coords, 1.0) @ self.lattice
+        distances, rows = self.tree.query(cart_coords, workers=-1)
+        return rows % self.n_sites, distances
+
+
+class OccupancyTracker:
+    """
+    Running occupancy, residence and hop statistics of a set of mobile ions.
+    """
+
+    def __init__(self, n_sites, n_ions):
+        self.n_sites = n_sites
+        self.occupied_frames = np.zeros(n_sites, dtype=np.int64)   # frames with at least one ion on the site
+        self.occupation = np.zeros(n_sites, dtype=np.int64)        # ion-frames on the site
+        self.residence_frames = np.zeros(n_sites, dtype=np.int64)  # summed length of completed visits
+        self.visits = np.zeros(n_sites, dtype=np.int64)            # completed visits
+        self.hops = np.zeros((n_sites, n_sites), dtype=np.int64)   # hops[i, j]: ion moved from site i to j
+        self.current = np.full(n_ions, -1)
+        self.arrived = np.zeros(n_ions, dtype=np.int64)
+        self.n_frames = 0
+
+    def add_frame(self, nearest, distances=None, capture_radius=None):
+        frame = self.n_frames
+        if frame == 0:
+            self.current = nearest.copy()
+        else:
+            moved = nearest != self.current
+            if capture_radius is not None:
+                moved &= distances < capture_radius
+            if moved.any():
+                old, new = self.current[moved], nearest[moved]
+                np.add.at(self.residence_frames, old, frame - self.arrived[moved])
+                np.add.at(self.visits, old, 1)
+                np.add.at(self.hops, (old, new), 1)
+                self.current[moved] = new
+                self.arrived[moved] = frame
+
+        self.occupation += np.bincount(self.current, minlength=self.n_sites)
+        self.occupied_frames[np.unique(self.current)] += 1
+        self.n_frames += 1
+
+    def finish(self):
+        """
+        Close the visits still open at the end of the run (their true length is
+        unknown, so they are counted as lasting until the last frame).
+        """
+        np.add.at(self.residence_frames, self.current, self.n_frames - self.arrived)
+        np.add.at(self.visits, self.current, 1)
+        self.arrived[:] = self.n_frames
+
+    @property
+    def occupancy(self):
+        """
+        Fraction of frames in which each site holds at least one ion.
+        """
+        return self.occupied_frames / max(self.n_frames, 1)
+
+    @property
+    def mean_residence(self):
+        """
+        Mean length of a visit to each site, in frames (nan if never visited).
+        """
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(self.visits > 0, self.residence_frames / self.visits, np.nan)
+
+
+def track_occupancy(path, sites, lattice, mobile_species, start=0, stride=1, capture_radius=None, block_size=100):
+    """
+    Assign every mobile ion of frames start::stride to its nearest site and
+    accumulate the statistics. Returns the finished OccupancyTracker.
+    """
+    trajectory = open_trajectory(path)
+    ions = np.flatnonzero(np.isin(trajectory.species, mobile_species))
+    site_tree = SiteTree(sites, lattice)
+    tracker = OccupancyTracker(len(sites), len(ions))
+
+    def process(block):
+        # One tree query for the whole block of frames
+        nearest, distances = site_tree.nearest(np.stack(block))
+        for frame_nearest, frame_distances in zip(nearest, distances):
+            tracker.add_frame(frame_nearest, frame_distances, capture_radius)
+
+    block = []
+    for frame in trajectory.iter_frames(start=start, stride=stride):
+        block.append(np.asarray(frame.frac_coords, dtype=float)[ions])
+        if len(block) == block_size:
+            process(block)
+            block = []
+    if block:
+        process(block)
+    tracker.finish()
+    return tracker
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Occupancy, residence times and hops of mobile ions over "
+                                                 "interstitial sites during an MD run.")
+    parser.add_argument("trajectory", nargs="?", default="XDATCAR", help="XDATCAR or binary trajectory directory")
+    parser.add_argument("--sites", default="structure_with_added_atoms.vasp",
+                        help="Output structure of find_all_tet_oct_sites.py")
+    parser.add_argument("--host", required=True,
+                        help="Host structure given to find_all_tet_oct_sites.py (its sites are skipped)")
+    parser.add_argument("--tet-species", required=True, help="Species placed on the tetrahedral sites")
+    parser.add_argument("--oct-species", help="Species placed on the octahedral sites")
+    parser.add_argument("--mobile", nargs="+", required=True, help="Mobile species, e.g. Li")
+    parser.add_argument("--capture-radius", type=float, help="Distance (A) within which an ion is taken to have hopped")
+    parser.add_argument("--start", type=int, default=0, help="First frame (e.g. to skip equilibration)")
+    parser.add_argument("--stride", type=int, default=1, help="Use every n-th frame")
+    parser.add_argument("--timestep", type=float, help="Time between analysed frames (ps), for residence times in ps")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    n_host = len(Structure.from_file(args.host))
+    sites, types, lattice = load_sites(args.sites, n_host, args.tet_species, args.oct_species)
+    print(f"{types.count('tet')} tetrahedral and {types.count('oct')} octahedral sites")
+
+    tracker = track_occupancy(args.trajectory, sites, lattice, args.mobile, args.start, args.stride,
+                              args.capture_radius)
+    scale, unit = (args.timestep, "ps") if args.timestep else (1, "frames")
+    print(f"{tracker.n_frames} frames analysed, {tracker.hops.sum()} hops")
+
+    types = np.array(types)
+    for site_type in ("tet", "oct"):
+        chosen = types == site_type
+        if chosen.any():
+            print(f"{site_type}: mean occupancy {tracker.occupancy[chosen].mean():.3f}, "
+                  f"{tracker.visits[chosen].sum()} visits, "
+                  f"mean residence {tracker.residence_frames[chosen].sum() / max(tracker.visits[chosen].sum(), 1) * scale:.3f} {unit}")
+    for from_type in ("tet", "oct"):
+        for to_type in ("tet", "oct"):
+            count = tracker.hops[np.ix_(types == from_type, types == to_type)].sum()
+            print(f"    {from_type} -> {to_type} hops: {count}")
+
+    with open("site_occupancy.txt", "w") as f:
+        f.write(f"Site\tType\tx\ty\tz\tOccupancy\tMean occupation\tVisits\tMean residence ({unit})\n")
+        for i, (frac, site_type) in enumerate(zip(sites, types)):
+            f.write(f"{i}\t{site_type}\t{frac[0]:.5f}\t{frac[1]:.5f}\t{frac[2]:.5f}\t{tracker.occupancy[i]:.5f}\t"
+                    f"{tracker.occupation[i] / tracker.n_frames:.5f}\t{tracker.visits[i]}\t"
+                    f"{tracker.mean_residence[i] * scale:.4f}\n")
+
+    with open("site_hops.txt", "w") as f:
+        f.write("From\tTo\tHops\n")
+        for i, j in zip(*np.nonzero(tracker.hops)):
+            f.write(f"{i}\t{j}\t{tracker.hops[i, j]}\n")
+    print("Per-site results written to site_occupancy.txt, hop counts to site_hops.txt")
@@ -1,24 +1,44 @@
+import multiprocessing
 import os
 import re
-from mp_api.client import MPRester
-from pymatgen.analysis.phase_diagram import PhaseDiagram, PDPlotter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pymatgen.entries.mixing_scheme import MaterialsProjectDFTMixingScheme
-from pymatgen.io.vasp import Vasprun
 from pymatgen.entries.compatibility import ComputedEntry, ComputedStructureEntry
-from pymatgen.core import Element
+from mp_entry_cache import default_cache
+from stability_batch import batch_chemsystems, stability_windows, file_hash, stability_record, set_windows, \
+    additional_inputs, ResultLog, write_tables
+from vasprun_entry import read_vasprun_entry
+from hull_store import HullStore
 
 # Initialize API Key
 API_KEY = ""
 
-open_element = "Cu"
+# Materials Project entries are cached on disk and reused across compounds and
+# batches; set MP_OFFLINE=1 to run from the cache only (see mp_entry_cache.py)
+entry_cache = default_cache(API_KEY)
+
+# Convex hulls of the MP entries, built once per chemical system and reused
+# (see hull_store.py); only the compound's own entries are added to them
+hull_store = HullStore()
+
+open_elements = ["Cu"]  # e.g. ["Li", "Cu", "Ag"], one window column pair each
 vasprun_file = "r2SCAN/vasprun.xml"
 subdirs = sorted(set(next(os.walk('.'))[1]))  # Ensure no duplicates in subdirs
-cwd = os.getcwd()  # get directory to return to
+cwd = os.getcwd()  # batch directory, all paths are built from it
+workers = None  # worker processes for the subdirectories (None: all cores)
 
 # Path to additional calculations
 other_calculations_dir = os.path.abspath("../../../A2BMX6/copper/rubidium/Cl/")  # Ensure absolute path
 other_calc_subdirs = next(os.walk(other_calculations_dir))[1]
 
+# Every compound's result is appended to results_file as soon as it is known;
+# a rerun only computes the compounds that are new or changed (resume = False
+# recomputes all of them)
+results_file = "new_r2SCAN_results.jsonl"
+resume = True
+settings = {"open_elements": open_elements, "vasprun_file": vasprun_file,
+            "other_calculations_dir": other_calculations_dir}
+
 def elements_to_sorted_string(elements_set):
     """
     Convert a set of Element objects into a sorted string representation.
@@ -89,151 +109,158 @@ def create_adjusted_entry(entry, ehull, adjustment=0.1):
             entry_id=entry.entry_id
         )
 
-processed_subdirs = set()  # To track processed subdirectories
+def analyse_subdir(subdir, vasprun_hash):
+    """
+    Stability analysis of one subdirectory (given relative to cwd, read
+    through absolute paths). Returns its record for the ResultLog.
+    """
+    record = stability_record(subdir, vasprun_hash, settings)
+    path = os.path.join(cwd, subdir, vasprun_file)
 
-with open("new_r2SCAN.txt", "w") as sw_file, open("new_reactions.txt", "w") as reactions_file:
-    sw_file.write("Structure\tLower limit (V)\tUpper limit (V)\tEnergy Above Hull (eV/atom)\tStability Window Error\tHull Calculation Error\n")
+    # Check if the vasprun.xml file exists
+    if not os.path.exists(path):
+        print(f"Missing {vasprun_file} in {subdir}. Skipping...")
+        record.update(status="failed", error="missing vasprun.xml")
+        return record
 
-    for subdir in subdirs:
-        if subdir in processed_subdirs:
-            continue  # Skip if the subdir was already processed
-        processed_subdirs.add(subdir)
+    # Energy, structure and run type only, cached next to the vasprun.xml
+    vasprun = read_vasprun_entry(path)
+    entry = vasprun.entry
+    if entry is None:
+        record.update(status="failed", error="entry_is_none")
+        return record
 
-        os.chdir(subdir)
-        try:
-            # Check if the vasprun.xml file exists
-            if not os.path.exists(vasprun_file):
-                print(f"Missing {vasprun_file} in {subdir}. Skipping...")
-                sw_file.write(f"{subdir}\tfailed\tfailed\tfailed\n")
-                os.chdir(cwd)
-                continue
-
-            vasprun = Vasprun(vasprun_file)
-            entry = vasprun.get_computed_entry(inc_structure=True)
-            if entry is None:
-                sw_file.write(f"{subdir}\tfailed\tfailed\tfailed\n")
-                os.chdir(cwd)
-                continue
-
-            # Check run_type
-            if entry.parameters.get("run_type") == "r2SCAN":
-                entry.parameters["run_type"] = "R2SCAN"
-            elif entry.parameters.get("run_type") != "R2SCAN":
-                print("No r2SCAN run found")  # Keep the print for debugging
-
-            system_name = entry.composition.reduced_formula
-            elements_set = set(entry.composition.elements)
-            elements = set(vasprun.atomic_symbols)
-            print(f"Processing {system_name} with elements: {elements_set}")
-
-            additional_vasprun_path = find_matching_additional_entry(elements_set)
-            additional_entry = None
-            if additional_vasprun_path:
-                additional_vasprun = Vasprun(additional_vasprun_path)
-                additional_entry = additional_vasprun.get_computed_entry(inc_structure=True)
-                if additional_entry.parameters.get("run_type") == "r2SCAN":
-                    additional_entry.parameters["run_type"] = "R2SCAN"
-
-            # Get unique entries from Materials Project
-            with MPRester(API_KEY) as rester:
-                mp_entries = rester.get_entries_in_chemsys(
-                    elements=list(elements),
-                    additional_criteria={"thermo_types": ["R2SCAN"]}
-                )
-                for mp_entry in mp_entries:
-                    run_type = mp_entry.parameters.get("run_type")
-                    if run_type == "r2SCAN":
-                        mp_entry.parameters["run_type"] = "R2SCAN"
-                        
-                # Remove duplicates by entry_id
-                mp_entries = list({entry.entry_id: entry for entry in mp_entries}.values())
-
-            all_entries = [entry] + mp_entries
-            if additional_entry and additional_entry not in all_entries:
-                all_entries.append(additional_entry)
-                print(f"Using additional entry for {system_name} from {additional_vasprun_path}")
-
-            scheme = MaterialsProjectDFTMixingScheme()
-            corrected_entries = scheme.process_entries(all_entries)
-            pd = PhaseDiagram(corrected_entries)
-            hull_calculation_error = "None"  # Default value in case no error occurs
-            try:
-                original_ehull = pd.get_e_above_hull(entry)
-                print(f"The original energy above hull of {system_name} is {original_ehull:.3f} eV/atom.")
-                if additional_entry is not None:
-                    ehull_additional = pd.get_e_above_hull(additional_entry)
-                    print(f"The original energy above hull of additional entry is {ehull_additional:.3f} eV/atom.")
-
-                adjusted_entry = entry
-                if original_ehull is not None and original_ehull > 0:
-                    # Create an adjusted entry using the ComputedStructureEntry if needed
-                    adjusted_entry = create_adjusted_entry(entry, original_ehull)
-                    if additional_entry is not None:
-                        corrected_entries = scheme.process_entries([adjusted_entry] + [additional_entry] + mp_entries)
-                        pd = PhaseDiagram(corrected_entries)
-                    else:
-                        corrected_entries = scheme.process_entries([adjusted_entry] + mp_entries)
-                        pd = PhaseDiagram(corrected_entries)
-                        print(f"Using single entry without additional calculation for {subdir}")
-                        sw_file.write(f"{system_name}\t{original_ehull:.3f}\tInfo: Only {subdir} entry used, additional entry was None.\n")
-                else:
-                    pd = PhaseDiagram(corrected_entries)
-            except Exception as e:
-                original_ehull = None
-                hull_calculation_error = str(e)
-                print(f"Failed to calculate energy above hull for {system_name}: {hull_calculation_error}")
+    # Check run_type
+    if entry.parameters.get("run_type") == "r2SCAN":
+        entry.parameters["run_type"] = "R2SCAN"
+    elif entry.parameters.get("run_type") != "R2SCAN":
+        print("No r2SCAN run found")  # Keep the print for debugging
+
+    system_name = entry.composition.reduced_formula
+    record["structure"] = system_name
+    elements_set = set(entry.composition.elements)
+    elements = set(vasprun.atomic_symbols)
+    print(f"Processing {system_name} with elements: {elements_set}")
+
+    additional_vasprun_path = find_matching_additional_entry(elements_set)
+    record["additional"] = additional_inputs(other_calculations_dir, additional_vasprun_path)
+    additional_entry = None
+    if additional_vasprun_path:
+        additional_entry = read_vasprun_entry(additional_vasprun_path).entry
+        if additional_entry.parameters.get("run_type") == "r2SCAN":
+            additional_entry.parameters["run_type"] = "R2SCAN"
+
+    # Get unique entries from Materials Project (through the local cache)
+    mp_entries = entry_cache.get_entries_in_chemsys(elements=list(elements), thermo_types=["R2SCAN"])
+    for mp_entry in mp_entries:
+        run_type = mp_entry.parameters.get("run_type")
+        if run_type == "r2SCAN":
+            mp_entry.parameters["run_type"] = "R2SCAN"
+
+    # Remove duplicates by entry_id
+    mp_entries = list({entry.entry_id: entry for entry in mp_entries}.values())
+
+    all_entries = [entry] + mp_entries
+    if additional_entry and additional_entry not in all_entries:
+        all_entries.append(additional_entry)
+        print(f"Using additional entry for {system_name} from {additional_vasprun_path}")
+
+    scheme = MaterialsProjectDFTMixingScheme()
+    corrected_entries = scheme.process_entries(all_entries)
+    mp_ids = {e.entry_id for e in mp_entries}
+    pd = hull_store.phase_diagram(corrected_entries, mp_ids)
+    record["hull_error"] = "None"  # Default value in case no error occurs
+    adjusted_entry = entry
+    try:
+        original_ehull = pd.get_e_above_hull(entry)
+        record["ehull"] = original_ehull
+        print(f"The original energy above hull of {system_name} is {original_ehull:.3f} eV/atom.")
+        if additional_entry is not None:
+            ehull_additional = pd.get_e_above_hull(additional_entry)
+            record["ehull_additional"] = ehull_additional
+            print(f"The original energy above hull of additional entry is {ehull_additional:.3f} eV/atom.")
+
+        if original_ehull is not None and original_ehull > 0:
+            # Create an adjusted entry using the ComputedStructureEntry if needed
+            adjusted_entry = create_adjusted_entry(entry, original_ehull)
+            if additional_entry is not None:
+                corrected_entries = scheme.process_entries([adjusted_entry] + [additional_entry] + mp_entries)
+                pd = hull_store.phase_diagram(corrected_entries, mp_ids)
+            else:
+                corrected_entries = scheme.process_entries([adjusted_entry] + mp_entries)
+                pd = hull_store.phase_diagram(corrected_entries, mp_ids)
+                print(f"Using single entry without additional calculation for {subdir}")
+    except Exception as e:
+        record.update(ehull=None, hull_error=str(e))
+        print(f"Failed to calculate energy above hull for {system_name}: {e}")
 
+    # Windows against every open element from the same phase diagram
+    print(f"Current electrochemistry attempt using {subdir}")
+    set_windows(record, *stability_windows(pd, corrected_entries, adjusted_entry.composition, open_elements))
+    return record
+
+
+def _analyse_safely(subdir, vasprun_hash):
+    # An unexpected error only fails its own subdirectory, not the batch, and
+    # is not final: the subdirectory is retried on the next run
+    try:
+        return analyse_subdir(subdir, vasprun_hash)
+    except Exception as e:
+        print(f"Error processing {subdir}: {e}")
+        record = stability_record(subdir, vasprun_hash, settings)
+        record.update(status="error", error=str(e))
+        return record
+
+
+def run_batch(subdirs, workers=None):
+    """
+    Analyse the subdirectories without a valid record in worker processes,
+    appending each result to the log as it completes, then write the tables.
+    The MP entries of each maximal chemical system are fetched in a
+    background thread, and the subdirectories it covers are dispatched as
+    soon as they arrive, while later fetches are still running.
+    """
+    log = ResultLog(os.path.join(cwd, results_file), settings)
+    vasprun_hashes = {subdir: file_hash(os.path.join(cwd, subdir, vasprun_file)) for subdir in subdirs}
+    pending = [subdir for subdir in subdirs if not (resume and log.valid(subdir, vasprun_hashes[subdir]))]
+    print(f"{len(subdirs) - len(pending)} of {len(subdirs)} compounds unchanged since the last run")
+
+    chemsystems = batch_chemsystems(pending, vasprun_file)
+    plan = entry_cache.prefetch_plan(chemsystems.values(), thermo_types=["R2SCAN"])
+
+    # Workers come from a fork server, not forked from this process, so none
+    # inherits the fetch thread's cache state or open files mid-operation
+    with ThreadPoolExecutor(max_workers=1) as fetcher, \
+            ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("forkserver")) as pool:
+        futures = {}
+
+        def submit(subdir):
+            futures[subdir] = pool.submit(_analyse_safely, subdir, vasprun_hashes[subdir])
+
+        # Subdirectories whose entries are already cached (or with no vasprun) can start now
+        for subdir in pending:
+            if subdir not in chemsystems or not any(chemsystems[subdir] <= superset for superset, _ in plan):
+                submit(subdir)
+
+        fetches = {fetcher.submit(entry_cache.prefetch_superset, superset, subsets, ["R2SCAN"]): superset
+                   for superset, subsets in plan}
+        for fetch in as_completed(fetches):
             try:
-                print(f"Current electrochemistry attempt using {subdir}")
-                Li_entries = [e for e in corrected_entries if e.composition.reduced_formula == open_element]
-                uLi0 = min(Li_entries, key=lambda e: e.energy_per_atom).energy_per_atom
-
-                el_profile = pd.get_element_profile(Element(open_element), adjusted_entry.composition)
-
-                voltages = []
-                reactions_data = []
-                for i, d in enumerate(el_profile):
-                    voltage = -(d["chempot"] - uLi0)
-                    voltages.append(voltage)
-                    reactions_data.append((voltage, d["reaction"]))
-
-                    stable_ranges = []
-                    start_voltage = None
-                    is_stable = lambda reactants, products: system_name in [r.reduced_formula for r in reactants] and \
-                        system_name in [p.reduced_formula for p in products]
-
-                for i, d in enumerate(el_profile):
-                    if is_stable(d["reaction"].reactants, d["reaction"].products):
-                        if start_voltage is None:
-                            start_voltage = voltages[i]
-                    else:
-                        if start_voltage is not None:
-                            stable_ranges.append((start_voltage, voltages[i]))
-                            start_voltage = None
-    
-        # Ensure the last stable range is captured
-                if start_voltage is not None:
-                    stable_ranges.append((start_voltage, voltages[-1]))
-
-                # Now, write results only ONCE
-                if stable_ranges:
-                    lower_limit = min(start for start, end in stable_ranges)
-                    upper_limit = max(end for start, end in stable_ranges)
-                    ehull_additional_str = f"{ehull_additional:.3f}" if additional_entry is not None else "None"
-                    sw_file.write(f"{system_name}\t{lower_limit:.3f}\t{upper_limit:.3f}\t{original_ehull if original_ehull is not None else 'failed'}\t{ehull_additional_str}\t{hull_calculation_error}\n")
-                else:
-                    stability_window_error = "no_stable_ranges"
-                    sw_file.write(f"{system_name}\tfailed\tfailed\t{original_ehull if original_ehull is not None else 'failed'}\t{stability_window_error}\t{hull_calculation_error}\n")
-
-                    # Write reaction data only ONCE per system
-                    reactions_file.write(f"Reactions for {system_name}:\n")
-                for voltage, reaction in reactions_data:
-                    reactions_file.write(f"Voltage: {voltage:.3f} V\n")
-                    reactions_file.write(f"{reaction}\n\n")
-                    
+                fetch.result()
             except Exception as e:
-                stability_window_error = str(e)
-                sw_file.write(f"{system_name}\tfailed\tfailed\t{original_ehull if original_ehull is not None else 'failed'}\t{ehull_additional_str}\t{stability_window_error}\t{hull_calculation_error}\n")
+                print(f"Prefetch of {'-'.join(sorted(fetches[fetch]))} failed: {e}")
+            for subdir in pending:
+                if subdir not in futures and chemsystems[subdir] <= fetches[fetch]:
+                    submit(subdir)
+
+        # Single writer: each result is checkpointed as soon as it completes
+        for future in as_completed(futures.values()):
+            log.append(future.result())
+
+    # The tables are regenerated from the log, in subdirectory order
+    write_tables([log.records[subdir] for subdir in subdirs], open_elements, "new_r2SCAN.txt",
+                 "new_reactions.txt", additional=True)
+
 
-        finally:
-            os.chdir(cwd)
+if __name__ == "__main__":
+    run_batch(subdirs, workers)
@@ -1,19 +1,35 @@
 import os
-from mp_api.client import MPRester
-from pymatgen.analysis.phase_diagram import PhaseDiagram, PDPlotter
 from pymatgen.entries.mixing_scheme import MaterialsProjectDFTMixingScheme
-from pymatgen.io.vasp import Vasprun
 from pymatgen.entries.compatibility import ComputedEntry, ComputedStructureEntry
-from pymatgen.core import Element
+from mp_entry_cache import default_cache
+from stability_batch import batch_chemsystems, stability_windows, file_hash, stability_record, set_windows, \
+    ResultLog, write_tables
+from vasprun_entry import read_vasprun_entry
+from hull_store import HullStore
 
 # Initialize API Key
 API_KEY = ""
 
-open_element = "Li"
+# Materials Project entries are cached on disk and reused across compounds and
+# batches; set MP_OFFLINE=1 to run from the cache only (see mp_entry_cache.py)
+entry_cache = default_cache(API_KEY)
+
+# Convex hulls of the MP entries, built once per chemical system and reused
+# (see hull_store.py); only the compound's own entries are added to them
+hull_store = HullStore()
+
+open_elements = ["Li"]  # e.g. ["Li", "Cu", "Ag"], one window column pair each
 vasprun_file = "r2SCAN/vasprun.xml"
 subdirs = next(os.walk('.'))[1]
 subdirs.sort()  # Sort the subdirectories alphabetically
 
+# Every compound's result is appended to results_file as soon as it is known;
+# a rerun only computes the compounds that are new or changed (resume = False
+# recomputes all of them)
+results_file = "stability_results.jsonl"
+resume = True
+settings = {"open_elements": open_elements, "vasprun_file": vasprun_file}
+
 def create_adjusted_entry(entry, ehull, adjustment=0.1):
     """
     Creates a new ComputedStructureEntry or ComputedEntry with the adjusted energy.
@@ -46,122 +62,83 @@ def create_adjusted_entry(entry, ehull, adjustment=0.1):
             entry_id=entry.entry_id
         )
 
-with open("stability_windows_r2SCAN.txt", "w") as sw_file, open("reactions.txt", "w") as reactions_file:
-    sw_file.write("Structure\tLower limit (V)\tUpper limit (V)\tEnergy Above Hull (eV/atom)\tStability Window Error\tHull Calculation Error\n")
-
-    for subdir in subdirs:
-        os.chdir(subdir)
-        stability_window_error = ""
-        hull_calculation_error = ""
-        try:
-            vasprun = Vasprun(vasprun_file)
-            entry = vasprun.get_computed_entry(inc_structure=True)
-            if entry is None:
-                stability_window_error = "entry_is_none"
-                hull_calculation_error = "entry_is_none"
-                sw_file.write(f"{subdir}\tfailed\tfailed\tfailed\t{stability_window_error}\t{hull_calculation_error}\n")
-                os.chdir('..')
-                continue
-
+# Results already in the log are reused unless their vasprun.xml or the settings changed
+log = ResultLog(results_file, settings)
+vasprun_hashes = {subdir: file_hash(os.path.join(subdir, vasprun_file)) for subdir in subdirs}
+pending = [subdir for subdir in subdirs if not (resume and log.valid(subdir, vasprun_hashes[subdir]))]
+print(f"{len(subdirs) - len(pending)} of {len(subdirs)} compounds unchanged since the last run")
+
+# Fetch the MP entries of the whole batch up front: one query per largest
+# chemical system, with the smaller systems sliced out of it locally
+entry_cache.prefetch(batch_chemsystems(pending, vasprun_file).values(), thermo_types=["R2SCAN"])
+
+for subdir in pending:
+    record = stability_record(subdir, vasprun_hashes[subdir], settings)
+    if vasprun_hashes[subdir] is None:
+        # Final until a vasprun.xml appears (its hash then no longer matches)
+        record.update(status="failed", error="missing vasprun.xml")
+        log.append(record)
+        continue
+
+    os.chdir(subdir)
+    try:
+        # Energy, structure, run type and convergence only, cached next to the vasprun.xml
+        vasprun = read_vasprun_entry(vasprun_file)
+        entry = vasprun.entry
+        if entry is None:
+            record.update(status="failed", error="entry_is_none", hull_error="entry_is_none")
+        else:
             system_name = entry.composition.reduced_formula
+            record["structure"] = system_name
 
             # Check whether the run has converged (ionic and electronic)
             is_ionic_converged = vasprun.converged_ionic
-            max_electronic_steps = vasprun.parameters["NELM"]
-            is_electronic_converged = all(len(step["electronic_steps"]) < max_electronic_steps for step in vasprun.ionic_steps)
+            is_electronic_converged = vasprun.all_steps_converged
 
             if not is_ionic_converged or not is_electronic_converged:
-                stability_window_error = "ionic_or_electronic_not_converged"
-                hull_calculation_error = "ionic_or_electronic_not_converged"
-                sw_file.write(f"{system_name}\tfailed\tfailed\tfailed\t{stability_window_error}\t{hull_calculation_error}\n")
+                record.update(status="failed", error="ionic_or_electronic_not_converged",
+                              hull_error="ionic_or_electronic_not_converged")
             else:
                 elements = set(vasprun.atomic_symbols)
 
-                # Fetch entries using the new Materials Project API
-                with MPRester(API_KEY) as rester:
-                    mp_entries = rester.get_entries_in_chemsys(
-                        elements=list(elements), 
-                        additional_criteria={"thermo_types": ["R2SCAN"]}
-                    )
+                # Fetch entries using the new Materials Project API (through the local cache)
+                mp_entries = entry_cache.get_entries_in_chemsys(elements=list(elements), thermo_types=["R2SCAN"])
 
                 if not mp_entries:
-                    sw_file.write(f"{system_name}\tfailed\tfailed\tfailed\tno_entries_found\t\n")
-                    os.chdir('..')
-                    continue
+                    record.update(status="failed", error="no_entries_found")
+                else:
+                    # Apply corrections with the mixing scheme
+                    scheme = MaterialsProjectDFTMixingScheme()
+                    corrected_entries = scheme.process_entries([entry] + mp_entries)
 
-                # Apply corrections with the mixing scheme
-                scheme = MaterialsProjectDFTMixingScheme()
-                corrected_entries = scheme.process_entries([entry] + mp_entries)
-
-                # Create phase diagram
-                pd = PhaseDiagram(corrected_entries)
-                plotter = PDPlotter(pd)
-
-                try:
-                    original_ehull = pd.get_e_above_hull(entry)
-                    print(f"The original energy above hull of {system_name} is {original_ehull:.3f} eV/atom.")
+                    # Create phase diagram
+                    mp_ids = {e.entry_id for e in mp_entries}
+                    pd = hull_store.phase_diagram(corrected_entries, mp_ids)
 
                     adjusted_entry = entry
-                    if original_ehull is not None and original_ehull > 0:
-                        # Create an adjusted entry using the ComputedStructureEntry if needed
-                        adjusted_entry = create_adjusted_entry(entry, original_ehull)
-                        corrected_entries = scheme.process_entries([adjusted_entry] + mp_entries)
-                        pd = PhaseDiagram(corrected_entries)
-                    else:
-                        pd = PhaseDiagram(corrected_entries)
-                except Exception as e:
-                    original_ehull = None
-                    hull_calculation_error = str(e)
-                    print(f"Failed to calculate energy above hull for {system_name}: {hull_calculation_error}")
-
-                try:
-                    Li_entries = [e for e in corrected_entries if e.composition.reduced_formula == open_element]
-                    uLi0 = min(Li_entries, key=lambda e: e.energy_per_atom).energy_per_atom
-
-                    el_profile = pd.get_element_profile(Element(open_element), adjusted_entry.composition)
-
-                    voltages = []
-                    reactions_data = []
-                    for i, d in enumerate(el_profile):
-                        voltage = -(d["chempot"] - uLi0)
-                        voltages.append(voltage)
-                        reactions_data.append((voltage, d["reaction"]))
-                    
-                    stable_ranges = []
-                    start_voltage = None
-                    is_stable = lambda reactants, products: system_name in [r.reduced_formula for r in reactants] and \
-                                                            system_name in [p.reduced_formula for p in products]
-
-                    for i, d in enumerate(el_profile):
-                        if is_stable(d["reaction"].reactants, d["reaction"].products):
-                            if start_voltage is None:
-                                start_voltage = voltages[i]
-                        else:
-                            if start_voltage is not None:
-                                stable_ranges.append((start_voltage, voltages[i]))
-                                start_voltage = None
-
-                    if start_voltage is not None:
-                        stable_ranges.append((start_voltage, voltages[-1]))
-
-                    if stable_ranges:
-                        lower_limit = min(start for start, end in stable_ranges)
-                        upper_limit = max(end for start, end in stable_ranges)
-                        sw_file.write(f"{system_name}\t{lower_limit:.3f}\t{upper_limit:.3f}\t{original_ehull if original_ehull is not None else 'failed'}\t\t{hull_calculation_error}\n")
-                    else:
-                        stability_window_error = "no_stable_ranges"
-                        sw_file.write(f"{system_name}\tfailed\tfailed\t{original_ehull if original_ehull is not None else 'failed'}\t{stability_window_error}\t{hull_calculation_error}\n")
-
-                    reactions_file.write(f"Reactions for {system_name}:\n")
-                    for voltage, reaction in reactions_data:
-                        reactions_file.write(f"Voltage: {voltage:.3f} V\n")
-                        reactions_file.write(f"{reaction}\n\n")
-                except Exception as e:
-                    stability_window_error = str(e)
-                    sw_file.write(f"{system_name}\tfailed\tfailed\t{original_ehull if original_ehull is not None else 'failed'}\t{stability_window_error}\t{hull_calculation_error}\n")
-        except Exception as e:
-            stability_window_error = str(e)
-            hull_calculation_error = str(e)
-            sw_file.write(f"{subdir}\tfailed\tfailed\tfailed\t{stability_window_error}\t{hull_calculation_error}\n")
-        os.chdir('..')
-
+                    try:
+                        original_ehull = pd.get_e_above_hull(entry)
+                        record["ehull"] = original_ehull
+                        print(f"The original energy above hull of {system_name} is {original_ehull:.3f} eV/atom.")
+
+                        if original_ehull is not None and original_ehull > 0:
+                            # Create an adjusted entry using the ComputedStructureEntry if needed
+                            adjusted_entry = create_adjusted_entry(entry, original_ehull)
+                            corrected_entries = scheme.process_entries([adjusted_entry] + mp_entries)
+                            pd = hull_store.phase_diagram(corrected_entries, mp_ids)
+                    except Exception as e:
+                        record.update(ehull=None, hull_error=str(e))
+                        print(f"Failed to calculate energy above hull for {system_name}: {e}")
+
+                    # Windows against every open element from the same phase diagram
+                    set_windows(record, *stability_windows(pd, corrected_entries, adjusted_entry.composition,
+                                                           open_elements))
+    except Exception as e:
+        # Unexpected errors are not final, the compound is retried on the next run
+        record.update(status="error", error=str(e), hull_error=str(e), ehull=None)
+    os.chdir('..')
+    log.append(record)
+
+# The tables are regenerated from the log, in subdirectory order
+write_tables([log.records[subdir] for subdir in subdirs], open_elements, "stability_windows_r2SCAN.txt",
+             "reactions.txt")
@@ -0,0 +1,131 @@
+#   Persistent reference convex hulls with incremental entry insertion.
+#
+#   The Materials Project entries of a chemical system, and so their convex
+#   hull, are the same for every compound of a batch; only the compound's own
+#   entries (the calculation, the additional calculation and the adjusted
+#   entry) differ. HullStore builds the PhaseDiagram of the reference entries
+#   once, keeps it in memory and on disk (keyed on the chemsys and a hash of
+#   the entries' ids and energies, so a changed MP entry set gives a new hull),
+#   and the compound's entries are inserted into it one at a time.
+#
+#   Inserting a point below the hull only changes the facets it can see (those
+#   whose plane lies above it): they are removed and the boundary of the
+#   removed region is joined to the new point. The other facets, and the
+#   reference data, are reused, and the result is handed to PhaseDiagram as
+#   precomputed data, so get_e_above_hull and get_element_profile work on it
+#   as on a freshly built diagram.
+
+import hashlib
+import itertools
+import os
+from collections import Counter
+import numpy as np
+from monty.serialization import dumpfn, loadfn
+from pymatgen.analysis.phase_diagram import PhaseDiagram
+
+hull_dir = os.environ.get("MP_HULL_STORE", os.path.join(os.path.expanduser("~"), ".cache", "mp_hulls"))
+
+
+def reference_key(entries):
+    """
+    Store key of a set of reference entries, e.g. "Cl-Cu-Li_3f2a9c01d2e4".
+    """
+    elements = sorted({el.symbol for entry in entries for el in entry.composition.elements})
+    fingerprint = sorted(f"{entry.entry_id}:{entry.composition.formula}:{entry.energy:.8f}" for entry in entries)
+    digest = hashlib.sha1("\n".join(fingerprint).encode()).hexdigest()[:12]
+    return "-".join(elements) + "_" + digest
+
+
+def _hull_point(pd, entry):
+    return np.array([entry.composition.get_atomic_fraction(el) for el in pd.elements[1:]] + [entry.energy_per_atom])
+
+
+def insert_entry(pd, entry, tol=1e-8):
+    """
+    PhaseDiagram with entry added, updating only the facets that lie above it.
+    Entries on or above the hull are added to all_entries only; new elements
+    or elemental references fall back to a full rebuild.
+    """
+    elements = set(entry.composition.elements)
+    if elements - set(pd.elements) or (entry.composition.is_element and
+                                       entry.energy_per_atom < pd.el_refs[entry.composition.elements[0]].energy_per_atom):
+        return PhaseDiagram(list(pd.all_entries) + [entry], pd.elements)
+
+    data = dict(pd.computed_data)
+    data["all_entries"] = list(pd.all_entries) + [entry]
+    point = _hull_point(pd, entry)
+
+    # Facets whose plane passes above the new point
+    visible = []
+    for facet in pd.facets:
+        vertices = pd.qhull_data[facet]
+        plane = np.linalg.solve(np.column_stack([vertices[:, :-1], np.ones(len(facet))]), vertices[:, -1])
+        if point[-1] < np.dot(plane[:-1], point[:-1]) + plane[-1] - tol:
+            visible.append(facet)
+    if not visible:
+        return PhaseDiagram(data["all_entries"], pd.elements, computed_data=data)
+
+    # The new point goes before the extra point that closes the hull
+    n_points = len(pd.qhull_entries)
+    qhull_data = np.insert(np.asarray(pd.qhull_data), n_points, point, axis=0)
+    qhull_data[-1, -1] = max(qhull_data[-1, -1], point[-1] + 1)
+
+    # Ridges of the visible region's boundary are joined to the new point
+    ridges = Counter(frozenset(ridge) for facet in visible for ridge in itertools.combinations(facet, len(facet) - 1))
+    visible_set = {frozenset(facet) for facet in visible}
+    facets = [list(facet) for facet in pd.facets if frozenset(facet) not in visible_set]
+    for ridge, count in ridges.items():
+        if count > 1:
+            continue
+        facet = sorted(ridge) + [n_points]
+        mat = qhull_data[facet].copy()
+        mat[:, -1] = 1
+        if abs(np.linalg.det(mat)) > 1e-14:
+            facets.append(facet)
+
+    data["facets"] = facets
+    data["qhull_data"] = qhull_data
+    data["qhull_entries"] = list(pd.qhull_entries) + [entry]
+    return PhaseDiagram(data["all_entries"], pd.elements, computed_data=data)
+
+
+class HullStore:
+    """
+    Reference PhaseDiagrams kept in memory and on disk, one per set of reference entries.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory or hull_dir
+        self.hulls = {}
+        os.makedirs(self.directory, exist_ok=True)
+
+    def reference(self, entries):
+        """
+        PhaseDiagram of the reference entries, built only the first time they are seen.
+        """
+        key = reference_key(entries)
+        if key in self.hulls:
+            return self.hulls[key]
+        path = os.path.join(self.directory, key + ".json.gz")
+        if os.path.exists(path):
+            pd = loadfn(path)
+        else:
+            pd = PhaseDiagram(entries)
+            tmp = f"{path}.{os.getpid()}.tmp.json.gz"
+            dumpfn(pd, tmp)
+            os.replace(tmp, path)
+        self.hulls[key] = pd
+        return pd
+
+    def phase_diagram(self, entries, reference_ids):
+        """
+        PhaseDiagram of entries, equivalent to PhaseDiagram(entries): the entries
+        whose entry_id is in reference_ids form the stored reference hull and the
+        others are inserted into it.
+        """
+        reference = self.reference([e for e in entries if e.entry_id in reference_ids])
+        pd = reference
+        for entry in entries:
+            if entry.entry_id not in reference_ids:
+                pd = insert_entry(pd, entry)
+        return pd
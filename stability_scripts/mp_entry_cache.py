@@ -0,0 +1,261 @@
+#   On-disk cache of Materials Project entries for the stability scripts.
+#
+#   Entries are stored per (sorted chemsys, thermo_types) as gzipped JSON
+#   (serialised with monty) under cache_dir, so a batch of compounds in the
+#   same chemical system downloads its entries once, and later batches not at
+#   all. Files older than the TTL are refetched, and once the cache grows past
+#   its size limit the least recently used files are deleted.
+#
+#   The entries come from a provider: MPRestProvider (the MP API) or
+#   LocalProvider (a fixed list of entries, e.g. for testing or for systems
+#   not in MP). In offline mode only the cache is read, for compute nodes
+#   without network access; a missing system raises OfflineCacheMiss.
+#
+#   For a batch, prefetch() takes the chemical systems of all compounds, fetches
+#   only the largest ones (those not contained in another) and slices the
+#   entries of every smaller system out of them locally, so a batch costs a
+#   handful of queries instead of one per compound.
+#
+#   Settings can also be given through the environment:
+#       MP_ENTRY_CACHE     cache directory
+#       MP_OFFLINE=1       offline mode
+#       MP_LOCAL_ENTRIES   JSON file of entries to use instead of the MP API
+
+import glob
+import gzip
+import json
+import os
+import time
+import numpy as np
+from monty.json import MontyEncoder
+from monty.serialization import loadfn
+
+cache_dir = os.environ.get("MP_ENTRY_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "mp_entries"))
+cache_ttl = 30 * 24 * 3600  # seconds
+cache_max_bytes = 2 * 1024 ** 3
+
+
+class OfflineCacheMiss(LookupError):
+    """
+    Raised in offline mode when a chemical system is not in the cache.
+    """
+
+
+def chemsys_key(elements, thermo_types=("R2SCAN",)):
+    """
+    Cache key of a chemical system, e.g. "Cl-Li-Rb__R2SCAN".
+    """
+    return "-".join(sorted(set(map(str, elements)))) + "__" + "+".join(sorted(thermo_types))
+
+
+def maximal_chemsystems(chemsystems):
+    """
+    The chemical systems (sets of element symbols) not contained in any other.
+    """
+    unique = sorted({frozenset(map(str, c)) for c in chemsystems}, key=len, reverse=True)
+    maximal = []
+    for chemsys in unique:
+        if not any(chemsys <= other for other in maximal):
+            maximal.append(chemsys)
+    return maximal
+
+
+def element_masks(entries, elements):
+    """
+    Bit mask of the elements of every entry over the ordered list elements.
+    """
+    bits = {el: 1 << i for i, el in enumerate(elements)}
+    return np.array([sum(bits[el.symbol] for el in entry.composition.elements) for entry in entries],
+                    dtype=np.int64)
+
+
+def slice_entries(entries, masks, elements, chemsys):
+    """
+    Entries whose elements all lie in chemsys, from their masks over elements.
+    """
+    target = sum(1 << i for i, el in enumerate(elements) if el in chemsys)
+    return [entries[i] for i in np.flatnonzero((masks & ~target) == 0)]
+
+
+class MPRestProvider:
+    """
+    Entries from the Materials Project API (mp_api is only imported when used).
+    """
+
+    def __init__(self, api_key=""):
+        self.api_key = api_key
+
+    def get_entries(self, elements, thermo_types):
+        from mp_api.client import MPRester
+        with MPRester(self.api_key) as rester:
+            return rester.get_entries_in_chemsys(elements=list(elements),
+                                                 additional_criteria={"thermo_types": list(thermo_types)})
+
+
+class LocalProvider:
+    """
+    Stand-in for the MP API serving the entries of a fixed list whose elements
+    all lie in the requested chemical system.
+    """
+
+    def __init__(self, entries):
+        self.entries = list(entries)
+
+    @classmethod
+    def from_file(cls, filename):
+        return cls(loadfn(filename))
+
+    def get_entries(self, elements, thermo_types):
+        elements = set(map(str, elements))
+        return [entry for entry in self.entries
+                if {el.symbol for el in entry.composition.elements} <= elements]
+
+
+def _remove(path):
+    # Another process may have evicted the file already
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class EntryCache:
+    """
+    get_entries_in_chemsys with a persistent on-disk cache in front of a provider.
+    """
+
+    def __init__(self, directory=None, provider=None, ttl=None, max_bytes=None, offline=False):
+        self.directory = directory or cache_dir
+        self.provider = provider if provider is not None else MPRestProvider()
+        self.ttl = cache_ttl if ttl is None else ttl
+        self.max_bytes = cache_max_bytes if max_bytes is None else max_bytes
+        self.offline = offline
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, elements, thermo_types=("R2SCAN",)):
+        return os.path.join(self.directory, chemsys_key(elements, thermo_types) + ".json.gz")
+
+    def load(self, elements, thermo_types=("R2SCAN",)):
+        """
+        Cached entries of a chemical system, or None if absent or expired
+        (expired files are still returned in offline mode).
+        """
+        path = self.path(elements, thermo_types)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        if not self.offline and time.time() - stat.st_mtime > self.ttl:
+            return None
+        # Record the use in the access time, for the least-recently-used eviction
+        try:
+            os.utime(path, (time.time(), stat.st_mtime))
+        except FileNotFoundError:
+            return None  # evicted by another process since the stat
+        except PermissionError:
+            pass  # shared read-only cache
+        try:
+            return loadfn(path)["entries"]
+        except (OSError, EOFError, ValueError):
+            # Evicted in the meantime, or a truncated or corrupt file: a miss, refetched
+            return None
+
+    def store(self, elements, thermo_types, entries):
+        path = self.path(elements, thermo_types)
+        record = {"chemsys": chemsys_key(elements, thermo_types), "created": time.time(), "entries": entries}
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with gzip.open(tmp, "wt") as f:
+            json.dump(record, f, cls=MontyEncoder)
+        os.replace(tmp, path)
+        self.evict()
+
+    def get_entries_in_chemsys(self, elements, thermo_types=("R2SCAN",)):
+        """
+        Entries of a chemical system from the cache, fetched and stored on a miss.
+        """
+        thermo_types = tuple(thermo_types)
+        entries = self.load(elements, thermo_types)
+        if entries is not None:
+            print(f"Using cached entries for {chemsys_key(elements, thermo_types)}")
+            return entries
+        if self.offline:
+            raise OfflineCacheMiss(f"{chemsys_key(elements, thermo_types)} is not in the cache {self.directory}")
+
+        entries = self.provider.get_entries(sorted(set(map(str, elements))), thermo_types)
+        self.store(elements, thermo_types, entries)
+        return entries
+
+    def prefetch_plan(self, chemsystems, thermo_types=("R2SCAN",)):
+        """
+        The queries prefetch() makes: (maximal system, smaller systems missing
+        from the cache) for every maximal system with something to fetch.
+        """
+        missing = {frozenset(map(str, c)) for c in chemsystems}
+        missing = {c for c in missing if self.load(c, thermo_types) is None}
+        plan = []
+        for superset in maximal_chemsystems(chemsystems):
+            subsets = [c for c in missing if c <= superset and c != superset]
+            if superset in missing or subsets:
+                plan.append((superset, subsets))
+            missing -= set(subsets) | {superset}
+        return plan
+
+    def prefetch_superset(self, superset, subsets, thermo_types=("R2SCAN",)):
+        """
+        Fetch one maximal system (or read it from the cache) and store the
+        entries of each of its smaller systems sliced out of it.
+        """
+        thermo_types = tuple(thermo_types)
+        try:
+            entries = self.get_entries_in_chemsys(superset, thermo_types)
+        except OfflineCacheMiss as e:
+            print(f"Cannot prefetch: {e}")
+            return
+        elements = sorted(superset)
+        masks = element_masks(entries, elements)
+        for chemsys in subsets:
+            self.store(chemsys, thermo_types, slice_entries(entries, masks, elements, chemsys))
+        print(f"Prefetched {chemsys_key(superset, thermo_types)} ({len(entries)} entries) "
+              f"and {len(subsets)} subsystems")
+
+    def prefetch(self, chemsystems, thermo_types=("R2SCAN",)):
+        """
+        Fill the cache for all the given chemical systems with one query per
+        maximal system, slicing the smaller systems out of its entries.
+        """
+        thermo_types = tuple(thermo_types)
+        for superset, subsets in self.prefetch_plan(chemsystems, thermo_types):
+            self.prefetch_superset(superset, subsets, thermo_types)
+
+    def evict(self):
+        """
+        Delete expired files, then the least recently used ones until the
+        cache is below its size limit.
+        """
+        now = time.time()
+        files = []
+        for path in glob.glob(os.path.join(self.directory, "*.json.gz")):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if now - stat.st_mtime > self.ttl:
+                _remove(path)
+            else:
+                files.append((stat.st_atime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            _remove(path)
+            total -= size
+
+
+def default_cache(api_key=""):
+    """
+    EntryCache configured from the environment (see the top of this file).
+    """
+    local_entries = os.environ.get("MP_LOCAL_ENTRIES")
+    provider = LocalProvider.from_file(local_entries) if local_entries else MPRestProvider(api_key)
+    return EntryCache(provider=provider, offline=os.environ.get("MP_OFFLINE") == "1")
@@ -0,0 +1,274 @@
+#   Helpers shared by the batch stability scripts.
+#
+#   stability_windows computes the electrochemical windows of a compound
+#   against several open elements (Li, Cu, Ag, ...) from one PhaseDiagram, so
+#   the entries are processed and the hull built once for all of them; the
+#   scripts write one lower/upper limit column pair per element.
+#
+#   Results are checkpointed: every compound's result is appended as one JSON
+#   line to a ResultLog as soon as it is known, keyed on its subdirectory and
+#   the hash of its vasprun.xml. A rerun skips the compounds whose record is
+#   still valid (same vasprun, same settings, same additional calculation and
+#   same set of candidate additional calculations, no unexpected error), and
+#   the tables are regenerated from the records, so a killed batch, or one
+#   with a few compounds added, only computes what is missing.
+
+import functools
+import hashlib
+import json
+import os
+import xml.etree.ElementTree as ET
+from pymatgen.core import Element
+
+
+def vasprun_elements(filename):
+    """
+    Element symbols of a vasprun.xml, read from its <atominfo> block only
+    (the parse stops there, near the top of the file).
+    """
+    elements = set()
+    for _, elem in ET.iterparse(filename, events=("end",)):
+        if elem.tag == "array" and elem.get("name") == "atomtypes":
+            # Fields: atomspertype, element, mass, valence, pseudopotential
+            for rc in elem.iter("rc"):
+                elements.add(rc.findall("c")[1].text.strip())
+            return elements
+    return elements
+
+
+def batch_chemsystems(subdirs, vasprun_file):
+    """
+    Chemical system of every subdirectory with a vasprun.xml, as {subdir: set of elements}.
+    """
+    chemsystems = {}
+    for subdir in subdirs:
+        path = os.path.join(subdir, vasprun_file)
+        if not os.path.exists(path):
+            continue
+        try:
+            chemsystems[subdir] = vasprun_elements(path)
+        except ET.ParseError as e:
+            print(f"Could not read the elements of {path}: {e}")
+    return chemsystems
+
+
+def reference_chempot(entries, open_element):
+    """
+    Chemical potential of the pure open element (uLi0): the lowest energy per
+    atom of its elemental entries.
+    """
+    element = Element(open_element)
+    elemental = [e for e in entries if e.composition.is_element and element in e.composition]
+    return min(elemental, key=lambda e: e.energy_per_atom).energy_per_atom
+
+
+def stability_window(pd, entries, composition, open_element):
+    """
+    Electrochemical stability of a compound against one open element, from the
+    element profile of an existing PhaseDiagram. Returns (stable_ranges,
+    reactions): the voltage ranges (V vs the element) where the compound is
+    stable and the (voltage, reaction) pairs along the profile.
+    """
+    uLi0 = reference_chempot(entries, open_element)
+    el_profile = pd.get_element_profile(Element(open_element), composition)
+    system_name = composition.reduced_formula
+
+    voltages = [-(d["chempot"] - uLi0) for d in el_profile]
+    reactions = [(voltage, d["reaction"]) for voltage, d in zip(voltages, el_profile)]
+
+    stable_ranges = []
+    start_voltage = None
+    for voltage, d in zip(voltages, el_profile):
+        reaction = d["reaction"]
+        if system_name in [r.reduced_formula for r in reaction.reactants] and \
+                system_name in [p.reduced_formula for p in reaction.products]:
+            if start_voltage is None:
+                start_voltage = voltage
+        elif start_voltage is not None:
+            stable_ranges.append((start_voltage, voltage))
+            start_voltage = None
+    if start_voltage is not None:
+        stable_ranges.append((start_voltage, voltages[-1]))
+    return stable_ranges, reactions
+
+
+def stability_windows(pd, entries, composition, open_elements):
+    """
+    stability_window for every open element on the same PhaseDiagram.
+    Returns {element: (lower, upper)} for the elements with a stable range,
+    {element: error} for the others, and {element: reactions}.
+    """
+    limits, errors, reactions = {}, {}, {}
+    for el in open_elements:
+        try:
+            stable_ranges, reactions[el] = stability_window(pd, entries, composition, el)
+        except Exception as e:
+            errors[el] = str(e)
+            continue
+        if stable_ranges:
+            limits[el] = (min(start for start, end in stable_ranges), max(end for start, end in stable_ranges))
+        else:
+            errors[el] = "no_stable_ranges"
+    return limits, errors, reactions
+
+
+def window_header(open_elements):
+    return "\t".join(f"{el} lower limit (V)\t{el} upper limit (V)" for el in open_elements)
+
+
+def window_columns(limits, open_elements):
+    """
+    Lower and upper limit columns of every open element, "failed" where there is no window.
+    """
+    columns = []
+    for el in open_elements:
+        if el in limits:
+            columns += [f"{limits[el][0]:.3f}", f"{limits[el][1]:.3f}"]
+        else:
+            columns += ["failed", "failed"]
+    return "\t".join(columns)
+
+
+def window_errors(errors):
+    return "; ".join(f"{el}: {error}" for el, error in errors.items())
+
+
+def reactions_block(system_name, reactions):
+    """
+    Reactions along the element profile of every open element, as written to the reactions file.
+    """
+    text = ""
+    for el, reactions_data in reactions.items():
+        text += f"Reactions for {system_name} ({el}):\n"
+        for voltage, reaction in reactions_data:
+            text += f"Voltage: {voltage:.3f} V\n"
+            text += f"{reaction}\n\n"
+    return text
+
+
+@functools.lru_cache(maxsize=None)
+def file_hash(filename):
+    """
+    sha1 of a file's contents, or None if it does not exist.
+    """
+    if not os.path.exists(filename):
+        return None
+    digest = hashlib.sha1()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def calculation_listing(directory, vasprun_file="r2SCAN/vasprun.xml"):
+    """
+    Sorted subdirectories of directory that contain vasprun_file.
+    """
+    if not os.path.isdir(directory):
+        return []
+    return sorted(folder for folder in next(os.walk(directory))[1]
+                  if os.path.exists(os.path.join(directory, folder, vasprun_file)))
+
+
+def additional_inputs(directory, path):
+    """
+    What the choice of an additional calculation depended on: the candidate
+    calculations in directory and the matched vasprun.xml (path, None if
+    there was no match) with its hash.
+    """
+    return {"directory": directory, "listing": calculation_listing(directory),
+            "path": path, "hash": file_hash(path) if path else None}
+
+
+def stability_record(subdir, vasprun_hash, settings, structure=None):
+    """
+    Result of one compound as stored in the ResultLog. status is "ok", "failed"
+    (a final result, e.g. not converged) or "error" (unexpected, retried on
+    the next run); additional holds the additional_inputs, if any were used.
+    """
+    return {"subdir": subdir, "vasprun_hash": vasprun_hash, "additional": None, "settings": settings,
+            "status": "ok", "structure": structure or subdir, "ehull": None, "ehull_additional": None,
+            "limits": {}, "window_errors": {}, "hull_error": "", "error": "", "reactions": {}}
+
+
+def set_windows(record, limits, errors, reactions):
+    """
+    Store the output of stability_windows in a record, reactions as strings.
+    """
+    record["limits"] = limits
+    record["window_errors"] = errors
+    record["reactions"] = {el: [(voltage, str(reaction)) for voltage, reaction in reactions_data]
+                           for el, reactions_data in reactions.items()}
+
+
+class ResultLog:
+    """
+    Append-only JSON-lines file of stability records; the last record of a
+    subdirectory is the current one.
+    """
+
+    def __init__(self, filename, settings):
+        self.filename = filename
+        self.settings = settings
+        self.records = {}
+        if not os.path.exists(filename):
+            return
+        with open(filename) as f:
+            text = f.read()
+        for line in text.splitlines():
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # line cut short by a killed run
+            self.records[record["subdir"]] = record
+        if text and not text.endswith("\n"):
+            with open(filename, "a") as f:
+                f.write("\n")
+
+    def valid(self, subdir, vasprun_hash):
+        """
+        The record of subdir if it can be reused, otherwise None.
+        """
+        record = self.records.get(subdir)
+        if record is None or record["status"] == "error" or record["settings"] != self.settings:
+            return None
+        if record["vasprun_hash"] != vasprun_hash:
+            return None
+        additional = record.get("additional")
+        if additional is not None:
+            # A new, removed or changed additional calculation can change the match
+            if calculation_listing(additional["directory"]) != additional["listing"]:
+                return None
+            if additional["path"] is not None and file_hash(additional["path"]) != additional["hash"]:
+                return None
+        return record
+
+    def append(self, record):
+        with open(self.filename, "a") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.records[record["subdir"]] = record
+
+
+def write_tables(records, open_elements, sw_filename, reactions_filename, additional=False):
+    """
+    Window table (one row per record, the same columns for every row) and
+    reactions file of a list of records.
+    """
+    with open(sw_filename, "w") as sw_file, open(reactions_filename, "w") as reactions_file:
+        header = ["Structure", window_header(open_elements), "Energy Above Hull (eV/atom)"]
+        if additional:
+            header.append("Additional Entry Energy Above Hull (eV/atom)")
+        sw_file.write("\t".join(header + ["Stability Window Error", "Hull Calculation Error"]) + "\n")
+
+        for record in records:
+            row = [record["structure"], window_columns(record["limits"], open_elements),
+                   str(record["ehull"]) if record["ehull"] is not None else "failed"]
+            if additional:
+                ehull_additional = record["ehull_additional"]
+                row.append(f"{ehull_additional:.3f}" if ehull_additional is not None else "None")
+            row += [record["error"] or window_errors(record["window_errors"]), record["hull_error"]]
+            sw_file.write("\t".join(row) + "\n")
+            reactions_file.write(reactions_block(record["structure"], record["reactions"]))
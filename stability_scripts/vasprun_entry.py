@@ -0,0 +1,137 @@
+#   Fast extraction of the ComputedStructureEntry of a vasprun.xml.
+#
+#   The stability scripts only need the final energy, composition, final
+#   structure, run_type and convergence flags, but Vasprun parses eigenvalues,
+#   DOS, forces and the structure of every ionic step. LightVasprun reads the
+#   header (generator, incar, parameters, atominfo), the energies of each
+#   ionic and electronic step and the final structure, and drops the large
+#   blocks as soon as they have been read; run_type, the convergence checks
+#   and get_computed_entry are Vasprun's own.
+#
+#   read_vasprun_entry caches the result in a JSON sidecar next to the file
+#   (<vasprun>.entry.json), keyed on its size and mtime, so a rerun, or the
+#   same additional calculation used by several compounds, is not parsed again.
+#
+#   LightVasprun skips Vasprun.__init__ and uses pymatgen's private parsing
+#   helpers (_parse_params, _parse_atominfo, _parse_structure, _vasprun_float).
+#   It was written against pymatgen 2026.9.24; if a later version changes
+#   those helpers, read_vasprun_entry falls back to the full Vasprun parser
+#   (with a warning, and the same POTCAR handling) rather than failing.
+
+import os
+import warnings
+from collections import namedtuple
+from lxml import etree
+from monty.serialization import dumpfn, loadfn
+from pymatgen.io.vasp import Vasprun
+from pymatgen.io.vasp.inputs import Incar
+from pymatgen.io.vasp.outputs import _vasprun_float
+
+VasprunSummary = namedtuple("VasprunSummary",
+                            "entry atomic_symbols converged_ionic converged_electronic all_steps_converged")
+
+# Blocks that are freed as soon as they have been read
+_skipped_tags = {"eigenvalues", "eigenvalues_kpoints_opt", "projected", "projected_kpoints_opt", "dos",
+                 "dielectricfunction", "dynmat"}
+_tags = ["generator", "incar", "parameters", "atominfo", "structure", "calculation"] + sorted(_skipped_tags)
+
+
+class LightVasprun(Vasprun):
+    """
+    Vasprun that only parses what get_computed_entry and the convergence
+    checks use. ionic_steps hold the energies and electronic steps only.
+    """
+
+    def __init__(self, filename, parse_potcar_file=True):
+        self.filename = filename
+        self.incar = Incar({})
+        self.md_data = []
+        self.ionic_steps = []
+        parsed_header = False
+        for event, elem in etree.iterparse(filename, events=("start", "end"), tag=_tags):
+            tag = elem.tag
+            if event == "start":
+                if tag == "calculation":
+                    parsed_header = True
+                continue
+
+            if not parsed_header:
+                if tag == "generator":
+                    self.generator = self._parse_params(elem)
+                elif tag == "incar":
+                    self.incar = self._parse_params(elem)
+                elif tag == "parameters":
+                    self.parameters = self._parse_params(elem)
+                elif tag == "atominfo":
+                    self.atomic_symbols, self.potcar_symbols = self._parse_atominfo(elem)
+                    self.potcar_spec = [{"titel": titel, "hash": None, "summary_stats": {}}
+                                        for titel in self.potcar_symbols]
+                elif tag == "structure" and elem.get("name") == "initialpos":
+                    self.initial_structure = self._parse_structure(elem)
+                    self.final_structure = self.initial_structure
+
+            if tag == "calculation":
+                self.ionic_steps.append(self._parse_energies(elem))
+                elem.clear()
+            elif tag == "structure" and elem.get("name") == "finalpos":
+                self.final_structure = self._parse_structure(elem)
+            elif tag in _skipped_tags:
+                elem.clear()
+
+        self.nionic_steps = len(self.ionic_steps)
+        self.vasp_version = self.generator["version"]
+        if parse_potcar_file:
+            self.update_potcar_spec(parse_potcar_file)
+            self.update_charge_from_potcar(parse_potcar_file)
+
+    @staticmethod
+    def _parse_energies(elem):
+        energy = elem.find("energy")
+        step = {i.get("name"): _vasprun_float(i.text) for i in energy.findall("i")} if energy is not None else {}
+        step["electronic_steps"] = [
+            {i.get("name"): _vasprun_float(i.text) for i in scstep.find("energy").findall("i")}
+            for scstep in elem.findall("scstep") if scstep.find("energy") is not None]
+        return step
+
+
+def sidecar_filename(filename):
+    return filename + ".entry.json"
+
+
+def summarise_vasprun(vasprun):
+    """
+    VasprunSummary of a parsed LightVasprun or Vasprun.
+    """
+    nelm = vasprun.parameters["NELM"]
+    return VasprunSummary(
+        entry=vasprun.get_computed_entry(inc_structure=True),
+        atomic_symbols=vasprun.atomic_symbols,
+        converged_ionic=vasprun.converged_ionic,
+        converged_electronic=vasprun.converged_electronic,
+        all_steps_converged=all(len(step["electronic_steps"]) < nelm for step in vasprun.ionic_steps))
+
+
+def read_vasprun_entry(filename, rebuild=False):
+    """
+    VasprunSummary of a vasprun.xml, from its sidecar if that matches the
+    file's size and mtime, otherwise parsed with LightVasprun and saved.
+    """
+    stat = os.stat(filename)
+    sidecar = sidecar_filename(filename)
+    if not rebuild and os.path.exists(sidecar):
+        saved = loadfn(sidecar)
+        if saved["size"] == stat.st_size and saved["mtime_ns"] == stat.st_mtime_ns:
+            return VasprunSummary(**saved["summary"])
+
+    try:
+        summary = summarise_vasprun(LightVasprun(filename, parse_potcar_file=True))
+    except (AttributeError, TypeError) as e:
+        # The private pymatgen helpers or attributes LightVasprun relies on have changed
+        warnings.warn(f"LightVasprun failed on {filename} ({e!r}), using the full Vasprun parser")
+        summary = summarise_vasprun(Vasprun(filename, parse_dos=False, parse_eigen=False,
+                                            parse_projected_eigen=False, parse_potcar_file=True))
+    try:
+        dumpfn({"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "summary": summary._asdict()}, sidecar)
+    except OSError:
+        pass  # read-only location, nothing is cached
+    return summary
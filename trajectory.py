@@ -0,0 +1,124 @@
+#   Compact binary trajectories, and one interface over them and XDATCARs.
+#
+#   convert_xdatcar turns an XDATCAR into a directory holding
+#       coords.npy    float32 fractional coordinates, (n_frames, n_atoms, 3)
+#       lattices.npy  cell of every frame, (n_frames, 3, 3)
+#       steps.npy     configuration numbers from the XDATCAR
+#       meta.json     species, counts, comment and source file
+#   coords.npy is opened as a memory map, so frame/atom slices are zero-copy
+#   views and nothing is read until it is used.
+#
+#   open_trajectory returns an XdatcarTrajectory or a BinaryTrajectory; both
+#   offer header, species, n_frames, iter_frames(start, stop, stride) and
+#   read_frames(frames), yielding xdatcar_reader.Frame tuples.
+#
+#   Usage: python trajectory.py XDATCAR [output directory]
+
+import json
+import os
+import sys
+import numpy as np
+from xdatcar_reader import (XdatcarHeader, Frame, read_header, species_list, iter_frames, read_frames,
+                            load_frame_index)
+
+
+def convert_xdatcar(filename, output=None):
+    """
+    Convert an XDATCAR into a binary trajectory directory (default <filename>.traj).
+    """
+    output = output or filename + ".traj"
+    os.makedirs(output, exist_ok=True)
+    header = read_header(filename)
+    n_atoms = sum(header.counts)
+    n_frames = len(load_frame_index(filename).frame_offsets)
+
+    coords = np.lib.format.open_memmap(os.path.join(output, "coords.npy"), mode="w+",
+                                       dtype=np.float32, shape=(n_frames, n_atoms, 3))
+    lattices = np.empty((n_frames, 3, 3))
+    steps = np.empty(n_frames, dtype=np.int64)
+    for frame in iter_frames(filename):
+        coords[frame.index] = frame.frac_coords
+        lattices[frame.index] = frame.lattice
+        steps[frame.index] = frame.step
+    coords.flush()
+    del coords
+
+    np.save(os.path.join(output, "lattices.npy"), lattices)
+    np.save(os.path.join(output, "steps.npy"), steps)
+    with open(os.path.join(output, "meta.json"), "w") as f:
+        json.dump({"comment": header.comment, "species": header.species, "counts": header.counts,
+                   "source": os.path.abspath(filename), "n_frames": n_frames, "n_atoms": n_atoms}, f, indent=2)
+    return output
+
+
+class BinaryTrajectory:
+    """
+    Reader for a trajectory written by convert_xdatcar.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.coords = np.load(os.path.join(path, "coords.npy"), mmap_mode="r")
+        self.lattices = np.load(os.path.join(path, "lattices.npy"))
+        self.steps = np.load(os.path.join(path, "steps.npy"))
+        self.header = XdatcarHeader(self.meta["comment"], self.lattices[0], self.meta["species"],
+                                    self.meta["counts"])
+        self.species = species_list(self.header)
+        self.n_frames = len(self.coords)
+
+    def frac_coords(self, frames=slice(None), atoms=slice(None)):
+        """
+        Zero-copy view of the float32 fractional coordinates of a frame/atom slice.
+        """
+        return self.coords[frames, atoms]
+
+    def read_frames(self, frames):
+        for i in frames:
+            yield Frame(int(i), int(self.steps[i]), self.lattices[i], self.coords[i])
+
+    def iter_frames(self, start=0, stop=None, stride=1):
+        return self.read_frames(range(*slice(start, stop, stride).indices(self.n_frames)))
+
+
+class XdatcarTrajectory:
+    """
+    The same interface over a text XDATCAR, streamed or read through its frame index.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.header = read_header(path)
+        self.species = species_list(self.header)
+        self._index = None
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = load_frame_index(self.path)
+        return self._index
+
+    @property
+    def n_frames(self):
+        return len(self.index.frame_offsets)
+
+    def read_frames(self, frames):
+        return read_frames(self.path, frames, self.index)
+
+    def iter_frames(self, start=0, stop=None, stride=1):
+        return iter_frames(self.path, start, stop, stride)
+
+
+def open_trajectory(path):
+    """
+    Open an XDATCAR or a binary trajectory directory with the same interface.
+    """
+    if os.path.isdir(path):
+        return BinaryTrajectory(path)
+    return XdatcarTrajectory(path)
+
+
+if __name__ == "__main__":
+    output = convert_xdatcar(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)
+    print("Binary trajectory written to", output)
@@ -0,0 +1,249 @@
+#   Streaming reader for VASP XDATCAR files.
+#
+#   Frames are read one at a time from a memory map of the file, so memory use
+#   is bounded by a single frame however long the MD run is. The atom count and
+#   species come from the header, and variable-cell (NPT) XDATCARs, where the
+#   header is repeated before every configuration, are supported.
+
+import mmap
+import os
+import warnings
+from collections import namedtuple
+import numpy as np
+
+XdatcarHeader = namedtuple("XdatcarHeader", "comment lattice species counts")
+# index: 0-based position in the file, step: number after 'Direct configuration='
+Frame = namedtuple("Frame", "index step lattice frac_coords")
+
+
+def _parse_header(lines):
+    """
+    Parse the 7 header lines (comment, scale, 3 lattice vectors, species,
+    counts) of an XDATCAR. Old files without the species line have 6.
+    """
+    comment = lines[0].decode().strip()
+    scale = float(lines[1].split()[0])
+    lattice = np.array([line.split()[:3] for line in lines[2:5]], dtype=float)
+    if scale < 0:
+        # A negative scale is the cell volume
+        lattice *= (-scale / abs(np.linalg.det(lattice))) ** (1 / 3)
+    else:
+        lattice *= scale
+
+    if len(lines) == 7:
+        species = [s.decode() for s in lines[5].split()]
+        counts = [int(c) for c in lines[6].split()]
+    else:
+        counts = [int(c) for c in lines[5].split()]
+        species = [f"X{i}" for i in range(len(counts))]
+    return XdatcarHeader(comment, lattice, species, counts)
+
+
+def _is_configuration(line):
+    return line.lstrip().lower().startswith(b"direct")
+
+
+def _read_header(mm):
+    lines = [mm.readline() for _ in range(6)]
+    # The species line is optional: if line 6 holds integers it is the counts line
+    try:
+        [int(c) for c in lines[5].split()]
+    except ValueError:
+        lines.append(mm.readline())
+    return _parse_header(lines)
+
+
+def _read_coords(mm, n_atoms):
+    """
+    Fractional coordinates (n_atoms x 3) of the next n_atoms lines, or None if
+    the file ends before the block is complete (a run stopped mid-write).
+    """
+    lines = [mm.readline() for _ in range(n_atoms)]
+    values = b"".join(lines).split()
+    n_columns = len(lines[-1].split())
+    if n_columns < 3 or len(values) != n_atoms * n_columns:
+        return None
+    return np.array(values, dtype=float).reshape(n_atoms, n_columns)[:, :3]
+
+
+def _truncated(filename, index):
+    warnings.warn(f"{filename}: configuration {index + 1} is incomplete (interrupted run?), "
+                  f"only the first {index} are read")
+
+
+def _open_map(filename):
+    f = open(filename, "rb")
+    try:
+        return f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:
+        f.close()
+        raise ValueError(f"{filename} is empty")
+
+
+def read_header(filename):
+    """
+    Header of an XDATCAR (first cell, species and counts).
+    """
+    f, mm = _open_map(filename)
+    with f, mm:
+        return _read_header(mm)
+
+
+def species_list(header):
+    """
+    Species of every atom, in file order.
+    """
+    return [sp for sp, n in zip(header.species, header.counts) for _ in range(n)]
+
+
+def iter_frames(filename, start=0, stop=None, stride=1):
+    """
+    Generator over the frames of an XDATCAR, each yielded as a Frame with the
+    cell (3x3, Angstrom) and the fractional coordinates (n_atoms x 3) as NumPy
+    arrays. Only frames start, start + stride, ... before stop are parsed; the
+    lines of the others are skipped.
+    """
+    f, mm = _open_map(filename)
+    with f, mm:
+        header = _read_header(mm)
+        n_atoms = sum(header.counts)
+        lattice = header.lattice
+        index = 0
+        while stop is None or index < stop:
+            line = mm.readline()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            if not _is_configuration(line):
+                # Repeated header of a variable-cell run; line is its comment
+                header_lines = [line] + [mm.readline() for _ in range(6)]
+                if not all(header_lines[:6]):
+                    _truncated(filename, index)
+                    break
+                if _is_configuration(header_lines[-1]):
+                    mm.seek(mm.tell() - len(header_lines[-1]))
+                    header_lines = header_lines[:-1]
+                lattice = _parse_header(header_lines).lattice
+                continue
+
+            wanted = index >= start and (index - start) % stride == 0
+            if wanted:
+                step = int(line.split(b"=")[-1]) if b"=" in line else index + 1
+                coords = _read_coords(mm, n_atoms)
+                if coords is None:
+                    _truncated(filename, index)
+                    break
+                yield Frame(index, step, lattice.copy(), coords)
+            else:
+                for _ in range(n_atoms):
+                    mm.readline()
+            index += 1
+
+
+#   Byte-offset frame index
+#
+#   The offset of every 'Direct configuration=' line, and of the header that
+#   applies to it, is stored in a sidecar file next to the XDATCAR. The sidecar
+#   records the size and mtime of the XDATCAR it was built from and is rebuilt
+#   when either changes. With it any frame can be read by seeking straight to it.
+
+FrameIndex = namedtuple("FrameIndex", "frame_offsets header_offsets steps")
+
+
+def index_filename(filename):
+    return filename + ".frameidx.npz"
+
+
+def build_frame_index(filename):
+    """
+    Scan an XDATCAR for the byte offsets of its configurations and headers.
+    """
+    f, mm = _open_map(filename)
+    with f, mm:
+        n_atoms = sum(_read_header(mm).counts)
+        frame_offsets, header_offsets, steps = [], [], []
+        current_header = 0
+        previous = None
+        pos = mm.find(b"Direct configuration")
+        while pos != -1:
+            line_start = mm.rfind(b"\n", 0, pos) + 1
+            if previous is not None:
+                # Lines beyond the previous configuration block belong to a repeated header
+                extra = mm[previous:line_start].count(b"\n") - (n_atoms + 1)
+                if extra > 0:
+                    header_start = line_start
+                    for _ in range(extra):
+                        header_start = mm.rfind(b"\n", 0, header_start - 1) + 1
+                    current_header = header_start
+            line_end = mm.find(b"\n", pos)
+            line = mm[pos:line_end if line_end != -1 else len(mm)]
+            frame_offsets.append(line_start)
+            header_offsets.append(current_header)
+            steps.append(int(line.split(b"=")[-1]) if b"=" in line else len(steps) + 1)
+            previous = line_start
+            pos = mm.find(b"Direct configuration", line_end if line_end != -1 else len(mm))
+
+        # The last configuration of an interrupted run may be cut short
+        if frame_offsets:
+            mm.seek(frame_offsets[-1])
+            mm.readline()
+            if _read_coords(mm, n_atoms) is None:
+                _truncated(filename, len(frame_offsets) - 1)
+                del frame_offsets[-1], header_offsets[-1], steps[-1]
+
+    return FrameIndex(np.array(frame_offsets, dtype=np.int64), np.array(header_offsets, dtype=np.int64),
+                      np.array(steps, dtype=np.int64))
+
+
+def load_frame_index(filename, rebuild=False):
+    """
+    Frame index of an XDATCAR, read from its sidecar if the sidecar matches
+    the file's size and mtime, otherwise built and saved.
+    """
+    stat = os.stat(filename)
+    sidecar = index_filename(filename)
+    if not rebuild and os.path.exists(sidecar):
+        with np.load(sidecar) as saved:
+            if int(saved["size"]) == stat.st_size and int(saved["mtime_ns"]) == stat.st_mtime_ns:
+                return FrameIndex(saved["frame_offsets"], saved["header_offsets"], saved["steps"])
+
+    index = build_frame_index(filename)
+    try:
+        np.savez(sidecar, size=stat.st_size, mtime_ns=stat.st_mtime_ns, **index._asdict())
+    except OSError:
+        pass  # read-only location, keep the index in memory only
+    return index
+
+
+def read_frames(filename, frames, index=None):
+    """
+    Generator over the requested frames (0-based, any order, e.g. a range with
+    a stride or an arbitrary list), each read by seeking to its offset.
+    """
+    if index is None:
+        index = load_frame_index(filename)
+    f, mm = _open_map(filename)
+    with f, mm:
+        header = _read_header(mm)
+        n_atoms = sum(header.counts)
+        lattices = {0: header.lattice}
+        for i in frames:
+            header_offset = int(index.header_offsets[i])
+            if header_offset not in lattices:
+                mm.seek(header_offset)
+                lattices[header_offset] = _read_header(mm).lattice
+            mm.seek(int(index.frame_offsets[i]))
+            mm.readline()
+            coords = _read_coords(mm, n_atoms)
+            if coords is None:
+                _truncated(filename, int(i))
+                return
+            yield Frame(int(i), int(index.steps[i]), lattices[header_offset].copy(), coords)
+
+
+def read_frame(filename, i, index=None):
+    """
+    Single frame i (0-based) of an XDATCAR.
+    """
+    return next(read_frames(filename, [i], index))